@@ -0,0 +1,228 @@
+import argparse
+import datetime
+import math
+import mmap
+import os
+import tempfile
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+
+from query import connect_read_only
+from weather_data import aggregate_values
+from weather_sql import CLIMATOLOGY_VALUES
+
+# Bulk analytics over stored data, such as ranking 2,000 venues by their precipitation in one week over 40 years.
+# The selected daily values are read from Weather_Table once into a flat array of doubles, grouped by location, and
+# written to a memory-mapped file. Worker processes map the same file and aggregate ranges of locations with
+# <aggregate_values>, so only (start, stop) offsets and the results cross between processes, never rows.
+# main.py stores one date per venue, so every date of the ranked range has to be ingested for each location first;
+# locations missing some of the selected values are left out rather than ranked on the days they happen to have.
+#
+#   python analytics.py precipitation avg --date 10 28 --days 7 --region 29 31 -91 -89 --top 10
+
+# Statistics of <aggregate_values> that locations can be ranked by
+RANK_STATISTICS = ('avg', 'sum', 'min', 'max', 'std', 'p10', 'p25', 'p50', 'p75', 'p90', 'count')
+
+# Memory-mapped values of the current worker process, from <_attach>
+_values = None
+
+
+class RankedLocation(NamedTuple):
+    """
+    One location of <rank_locations>
+        rank: Position, starting at 1
+        latitude, longitude: Stored location
+        value: Ranked statistic of the selected values
+        count: Number of values aggregated
+    """
+    rank: int
+    latitude: float
+    longitude: float
+    value: float
+    count: int
+
+
+class LocationValues(NamedTuple):
+    """
+    Daily values of one column for many locations, from <load_location_values>
+        locations: List of (latitude, longitude)
+        offsets: array('q') where the values of locations[i] are values[offsets[i]:offsets[i + 1]]
+        values: array('d') of every value, NaN where none is stored
+        years: Sorted list of the years stored for the selection
+    """
+    locations: list
+    offsets: array
+    values: array
+    years: list
+
+
+def event_dates(month: int, day: int, days: int = 1):
+    """
+    :param month: First month
+    :param day: First day
+    :param days: Number of days, continuing into the following months
+    :return: List of (month, day) for <days> days; February 29 is included when the range crosses it, as the dates
+    are counted in a leap year
+    """
+    first = datetime.date(2000, month, day)
+    dates = [first + datetime.timedelta(days=n) for n in range(days)]
+    return [(date.month, date.day) for date in dates]
+
+
+def load_location_values(column: str, dates: list = None, years: list = None, region: tuple = None,
+                         path: str = 'weather_data.db'):
+    """
+    Reads one daily value column of Weather_Table for every location in a single ordered query
+    :param column: 'temp', 'wind_speed', or 'precipitation'
+    :param dates: List of (month, day) to select; every stored date if None
+    :param years: Years to select; every stored year if None
+    :param region: (min_latitude, max_latitude, min_longitude, max_longitude); every location if None
+    :param path: sqlite database file written by main.py
+    :return: LocationValues
+    """
+    if column not in CLIMATOLOGY_VALUES:
+        raise ValueError(f'Unknown column {column}: choose one of {", ".join(CLIMATOLOGY_VALUES)}')
+
+    conditions, params = [], []
+    if dates is not None:
+        conditions.append(f'(Month, Day) IN (VALUES {", ".join("(?, ?)" for _ in dates)})')
+        params += [value for date in dates for value in date]
+    if years is not None:
+        conditions.append(f'Year IN ({", ".join("?" for _ in years)})')
+        params += list(years)
+    if region is not None:
+        conditions.append('Latitude BETWEEN ? AND ? AND Longitude BETWEEN ? AND ?')
+        params += list(region)
+    where = ' AND '.join(conditions) or '1 = 1'
+
+    locations, offsets, values, stored_years = [], array('q'), array('d'), set()
+    connection = connect_read_only(path)
+    try:
+        cursor = connection.execute(f'SELECT Latitude, Longitude, Year, {column} FROM Weather_Table WHERE {where} '
+                                    f'ORDER BY Latitude, Longitude;', params)
+        while True:
+            rows = cursor.fetchmany(10000)
+            if not rows:
+                break
+            for lat, long, year, value in rows:
+                if not locations or locations[-1] != (lat, long):
+                    locations.append((lat, long))
+                    offsets.append(len(values))
+                values.append(math.nan if value is None else value)
+                stored_years.add(year)
+    finally:
+        connection.close()
+    offsets.append(len(values))
+    return LocationValues(locations, offsets, values, sorted(stored_years))
+
+
+def aggregate_ranges(offsets: list, statistic: str, values=None):
+    """
+    Aggregates the values of consecutive locations, leaving out NaN
+    :param offsets: Offsets of the locations, and the end of the last one, into values
+    :param statistic: Key of <aggregate_values> to return
+    :param values: Sequence of doubles; the memory-mapped values of a worker process if None
+    :return: List of (value, count), one per location
+    """
+    values = _values if values is None else values
+    results = []
+    for start, stop in zip(offsets, offsets[1:]):
+        statistics = aggregate_values([value for value in values[start:stop] if value == value])
+        results.append((statistics[statistic], statistics['count']))
+    return results
+
+
+def _attach(path: str):
+    """
+    Worker process initializer: maps the values file read-only for <aggregate_ranges>
+    """
+    global _values
+    with open(path, 'rb') as file:
+        _values = memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)).cast('d')
+
+
+def rank_locations(column: str, statistic: str = 'avg', dates: list = None, years: list = None, region: tuple = None,
+                   path: str = 'weather_data.db', top: int = None, descending: bool = False, workers: int = None,
+                   chunk_locations: int = None, min_count: int = None):
+    """
+    Ranks stored locations by a statistic of their selected daily values, e.g. the driest venues of a week:
+    rank_locations('precipitation', 'avg', event_dates(10, 28, 7), range(1985, 2025), top=10)
+    Every date of the week must have been ingested for each location, e.g. by running main.py for each of them;
+    locations that only have some of the dates are left out rather than compared on fewer days.
+    :param column: 'temp', 'wind_speed', or 'precipitation'
+    :param statistic: One of <RANK_STATISTICS>
+    :param dates, years, region: Selection passed to <load_location_values>
+    :param path: sqlite database file written by main.py
+    :param top: Number of locations to return; every location if None
+    :param descending: Rank the highest value first instead of the lowest
+    :param workers: Processes aggregating at once; defaults to the number of CPUs. With 1, aggregation runs in this
+    process.
+    :param chunk_locations: Locations per task; by default each worker gets about four tasks
+    :param min_count: Fewest values a location needs to be ranked. Defaults to the expected count, the number of dates
+    times the number of years (every stored year of the selection if <years> is None), when <dates> is given, and to
+    1 otherwise.
+    :return: List of RankedLocation; locations with fewer than <min_count> values are left out
+    """
+    if statistic not in RANK_STATISTICS:
+        raise ValueError(f'Unknown statistic {statistic}: choose one of {", ".join(RANK_STATISTICS)}')
+    loaded = load_location_values(column, dates, years, region, path)
+    if min_count is None:
+        min_count = len(set(dates)) * len(set(loaded.years if years is None else years)) if dates else 1
+    min_count = max(min_count, 1)
+    workers = workers or os.cpu_count() or 1
+    chunk_locations = chunk_locations or max(1, math.ceil(len(loaded.locations) / (workers * 4)))
+    ranges = [loaded.offsets[start:start + chunk_locations + 1].tolist()
+              for start in range(0, len(loaded.locations), chunk_locations)]
+
+    if workers == 1 or len(ranges) <= 1:
+        results = [result for offsets in ranges for result in aggregate_ranges(offsets, statistic, loaded.values)]
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            values_path = os.path.join(directory, 'values.bin')
+            with open(values_path, 'wb') as file:
+                loaded.values.tofile(file)
+            with ProcessPoolExecutor(max_workers=workers, initializer=_attach, initargs=(values_path,)) as executor:
+                results = [result for chunk in executor.map(aggregate_ranges, ranges, [statistic] * len(ranges))
+                           for result in chunk]
+
+    scored = [(value, count, location) for (value, count), location in zip(results, loaded.locations)
+              if count >= min_count]
+    if len(scored) < len(loaded.locations):
+        print(f'Left out {len(loaded.locations) - len(scored)} of {len(loaded.locations)} locations with fewer than '
+              f'{min_count} values; ingest the missing dates or lower min_count to rank them')
+    scored.sort(key=lambda item: item[0], reverse=descending)
+    return [RankedLocation(rank, lat, long, value, count)
+            for rank, (value, count, (lat, long)) in enumerate(scored[:top], start=1)]
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description='Rank stored locations by a statistic of their daily values.')
+    parser.add_argument('column', choices=CLIMATOLOGY_VALUES, help='daily value to aggregate')
+    parser.add_argument('statistic', choices=RANK_STATISTICS, help='statistic to rank by')
+    parser.add_argument('--date', type=int, nargs=2, metavar=('MONTH', 'DAY'), help='first date; every date if not '
+                                                                                   'given')
+    parser.add_argument('--days', type=int, default=1, help='number of days from --date (default: 1)')
+    parser.add_argument('--years', type=int, nargs='+', help='years to aggregate; default is every stored year')
+    parser.add_argument('--region', type=float, nargs=4, metavar=('MIN_LAT', 'MAX_LAT', 'MIN_LONG', 'MAX_LONG'),
+                        help='only rank locations inside these bounds')
+    parser.add_argument('--top', type=int, default=20, help='number of locations to show (default: 20)')
+    parser.add_argument('--descending', action='store_true', help='rank the highest value first')
+    parser.add_argument('--workers', type=int, help='aggregating processes (default: number of CPUs)')
+    parser.add_argument('--min-count', type=int, help='fewest values a location needs to be ranked (default: days '
+                                                      'times years, so every date must be stored)')
+    parser.add_argument('--db', default='weather_data.db', help='sqlite database file (default: weather_data.db)')
+    args = parser.parse_args(argv)
+
+    from tabulate import tabulate
+
+    region = tuple(args.region) if args.region else None
+    dates = event_dates(*args.date, args.days) if args.date else None
+    ranked = rank_locations(args.column, args.statistic, dates, args.years, region, args.db, args.top,
+                            args.descending, args.workers, min_count=args.min_count)
+    print(tabulate(ranked, headers=['Rank', 'Latitude', 'Longitude', f'{args.statistic}({args.column})', 'Values'],
+                   tablefmt='grid'))
+
+
+if __name__ == '__main__':
+    main()
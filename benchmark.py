@@ -0,0 +1,214 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from unittest import mock
+
+from sqlalchemy.orm import sessionmaker
+
+from database import WeatherTable, create_weather_engine, init_db, upsert_weather_rows
+from main import ingest
+from mock_archive import MockArchiveServer
+from query import query_table
+from weather_data import WeatherData
+from weather_fetch import ArchiveClient, FetchJob, fetch_many
+from weather_grid import GRID_RESOLUTION, snap_to_grid
+
+# Benchmarks for the fetch, store, and query pipeline, run against <MockArchiveServer> so that they work offline
+# and do not load the real API. Every size is (number of years) x (number of locations).
+#
+#   python benchmark.py --years 5 20 40 --locations 1 10 50 --output bench_output.json
+
+LAST_YEAR = 2024
+
+# Libraries reported by <bench_startup> if a read-only lookup imports them
+HEAVY_LIBRARIES = ('sqlalchemy', 'requests', 'httpx', 'tabulate')
+
+
+def make_jobs(years: int, locations: int):
+    """
+    :return: List of (latitude, longitude, month, day, years) jobs for <locations> locations and <years> years, each
+    in its own archive grid cell
+    """
+    year_list = list(range(LAST_YEAR - years + 1, LAST_YEAR + 1))
+    return [(*snap_to_grid(29.9547 + n * GRID_RESOLUTION, -90.0751), 10, 31, year_list) for n in range(locations)]
+
+
+def make_rows(years: int, locations: int):
+    """
+    :return: List of WeatherTable row dictionaries for <locations> locations and <years> years
+    """
+    return [dict(Latitude=latitude, Longitude=longitude, Month=month, Day=day, Year=year,
+                 temp=60.0 + year % 17, wind_speed=5.0 + year % 11, precipitation=(year % 7) / 10)
+            for latitude, longitude, month, day, year_list in make_jobs(years, locations) for year in year_list]
+
+
+def bench_fetch(server: MockArchiveServer, years: int, locations: int, batch: bool, workers: int):
+    """
+    Measures <fetch_many> throughput against the mock server
+    :return: Result dictionary
+    """
+    jobs = make_jobs(years, locations)
+    client = ArchiveClient(requests_per_second=0, backoff=0.01)
+    before = server.requests
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = list(fetch_many(jobs, workers=workers, batch=batch, client=client, api_url=server.url))
+    seconds = time.perf_counter() - start
+
+    gathered = sum(len(result.weather.weather_series) for result in results if result.weather)
+    return {'stage': 'fetch', 'mode': 'batch' if batch else 'per_year', 'years': years, 'locations': locations,
+            'seconds': seconds, 'requests': server.requests - before, 'values': gathered,
+            'values_per_second': gathered / seconds}
+
+
+def bench_ingest(directory: str, years: int, locations: int, mode: str):
+    """
+    Measures writing rows into Weather_Table of a new database, one ORM object per row ('orm_add') or with
+    <upsert_weather_rows> ('bulk_upsert'), committed once
+    :return: Result dictionary, and the path of the database written
+    """
+    path = os.path.join(directory, f'ingest_{mode}_{years}_{locations}.db')
+    engine = create_weather_engine(path)
+    init_db(engine)
+    rows = make_rows(years, locations)
+    session = sessionmaker(bind=engine)()
+
+    start = time.perf_counter()
+    if mode == 'orm_add':
+        for row in rows:
+            session.add(WeatherTable(**row))
+    else:
+        upsert_weather_rows(session, rows)
+    session.commit()
+    seconds = time.perf_counter() - start
+
+    session.close()
+    engine.dispose()
+    return {'stage': 'ingest', 'mode': mode, 'years': years, 'locations': locations, 'seconds': seconds,
+            'rows': len(rows), 'rows_per_second': len(rows) / seconds}, path
+
+
+def bench_pipeline(server: MockArchiveServer, directory: str, years: int, locations: int, pipeline: bool,
+                   workers: int):
+    """
+    Measures a whole <main.ingest> run against the mock server into a new database, storing once at the end
+    ('one_transaction') or in batches while fetching ('pipeline')
+    :return: Result dictionary
+    """
+    mode = 'pipeline' if pipeline else 'one_transaction'
+    engine = create_weather_engine(os.path.join(directory, f'pipeline_{mode}_{years}_{locations}.db'))
+    init_db(engine)
+    jobs = [FetchJob(*job) for job in make_jobs(years, locations)]
+    client = ArchiveClient(requests_per_second=0, backoff=0.01)
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()), mock.patch.object(WeatherData, 'api_url', server.url):
+        rows = ingest(engine, jobs, client=client, workers=workers, pipeline=pipeline)
+    seconds = time.perf_counter() - start
+
+    engine.dispose()
+    return {'stage': 'ingest_run', 'mode': mode, 'years': years, 'locations': locations, 'seconds': seconds,
+            'rows': rows, 'rows_per_second': rows / seconds}
+
+
+def bench_query(path: str, years: int, locations: int, repeat: int):
+    """
+    Measures <query_table> latency for each location stored in the database at path
+    :return: Result dictionary
+    """
+    jobs = make_jobs(years, locations)
+    latencies = []
+    for n in range(repeat):
+        latitude, longitude, month, day, year_list = jobs[n % len(jobs)]
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            query_table(latitude, longitude, month, day, year_list, path=path)
+        latencies.append(time.perf_counter() - start)
+
+    latencies.sort()
+    return {'stage': 'query', 'mode': 'query_table', 'years': years, 'locations': locations, 'queries': repeat,
+            'mean_ms': statistics.mean(latencies) * 1000,
+            'p95_ms': latencies[int(0.95 * (len(latencies) - 1))] * 1000}
+
+
+def bench_startup(path: str, repeat: int):
+    """
+    Measures the wall time of read-only 'main.py --query' lookups in new interpreters, as run by dashboards, and
+    lists which heavy libraries the lookup imported
+    :param path: sqlite database to query
+    :return: Result dictionary
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+    command = [sys.executable, script, '--query', '29.9547', '-90.0751', '10', '31', '--db', path]
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        latencies.append(time.perf_counter() - start)
+
+    check = (f'import runpy, sys; sys.argv = {command[1:]!r}; runpy.run_path(sys.argv[0], run_name="__main__"); '
+             f'print(",".join(name for name in {HEAVY_LIBRARIES!r} if name in sys.modules))')
+    imported = subprocess.run([sys.executable, '-c', check], check=True, capture_output=True, text=True)
+    return {'stage': 'startup', 'mode': 'query_only', 'runs': repeat,
+            'mean_ms': statistics.mean(latencies) * 1000, 'min_ms': min(latencies) * 1000,
+            'heavy_imports': [name for name in imported.stdout.strip().splitlines()[-1].split(',') if name]}
+
+
+def run(years_sizes: list, location_sizes: list, latency: float, workers: int, query_repeat: int,
+        startup_repeat: int):
+    """
+    Runs every benchmark for every (years, locations) size
+    :return: List of result dictionaries
+    """
+    results = []
+    with MockArchiveServer(latency=latency) as server, tempfile.TemporaryDirectory() as directory:
+        for years in years_sizes:
+            for locations in location_sizes:
+                for batch in (False, True):
+                    results.append(bench_fetch(server, years, locations, batch, workers))
+                results.append(bench_ingest(directory, years, locations, 'orm_add')[0])
+                for pipeline in (False, True):
+                    results.append(bench_pipeline(server, directory, years, locations, pipeline, workers))
+                result, path = bench_ingest(directory, years, locations, 'bulk_upsert')
+                results.append(result)
+                results.append(bench_query(path, years, locations, query_repeat))
+                print(f'{years} years x {locations} locations done')
+        results.append(bench_startup(path, startup_repeat))
+    return results
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description='Benchmark the fetch, store, and query pipeline offline.')
+    parser.add_argument('--years', type=int, nargs='+', default=[5, 20, 40], help='numbers of years to test')
+    parser.add_argument('--locations', type=int, nargs='+', default=[1, 10, 50], help='numbers of locations to test')
+    parser.add_argument('--latency', type=float, default=0.005, help='mock server latency per request, in seconds')
+    parser.add_argument('--workers', type=int, default=8, help='fetch_many worker threads')
+    parser.add_argument('--query-repeat', type=int, default=50, help='query_table calls per size')
+    parser.add_argument('--startup-repeat', type=int, default=10, help='read-only main.py runs to time')
+    parser.add_argument('--output', default='bench_output.json', help='JSON file to write results to')
+    args = parser.parse_args(argv)
+
+    results = run(args.years, args.locations, args.latency, args.workers, args.query_repeat, args.startup_repeat)
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {'latency': args.latency, 'workers': args.workers},
+        'results': results,
+    }
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f'Results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
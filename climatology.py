@@ -0,0 +1,135 @@
+import datetime
+from array import array
+
+import requests
+from sqlalchemy import func, select
+from sqlalchemy.orm import sessionmaker
+
+from database import ClimatologyTable, upsert_climatology_rows
+from weather_data import BATCH_CHUNK_YEARS, VARIABLES, WeatherData, _chunk_years, aggregate_values, \
+    newest_archive_date, timed_get
+from weather_grid import snap_to_grid
+from weather_sql import CLIMATOLOGY_STATISTICS, CLIMATOLOGY_VALUES
+
+# Precomputed day-of-year statistics: the full daily series of a location is gathered once, in a few long requests,
+# and summarised for every calendar day into the Climatology table, so that "what is typical for this venue on this
+# day" is an indexed lookup (see <query.read_climatology>) instead of one API call per year.
+
+# Number of complete years summarised by default, as for climate normals
+CLIMATOLOGY_YEARS = 30
+
+
+def climatology_years(today: datetime.date = None):
+    """
+    :param today: Date to count back from; defaults to today
+    :return: List of the <CLIMATOLOGY_YEARS> most recent complete years
+    """
+    last_year = (today or datetime.date.today()).year - 1
+    return list(range(last_year - CLIMATOLOGY_YEARS + 1, last_year + 1))
+
+
+def fetch_daily_series(lat: float, long: float, years: list, session=None, chunk_years: int = BATCH_CHUNK_YEARS,
+                       api_url: str = None):
+    """
+    Gathers every day of <years> for a location, requesting up to <chunk_years> whole years per API call; days after
+    <weather_data.newest_archive_date>, such as the last days of December early in January, are not requested
+    :param lat: Location Latitude
+    :param long: Location Longitude
+    :param years: List of years
+    :param session: Object with a get(url=...) method, as in <WeatherData.call_weather_api>
+    :param chunk_years: Maximum span of one API call, in years
+    :param api_url: Archive API endpoint to use instead of <WeatherData.api_url>
+    :return: Dictionary of 'YYYY-MM-DD': dictionary of weather param: value, for every day of <years> in the archive
+    :raises ValueError: if a response has no usable daily data
+    """
+    http = session or requests
+    weather = WeatherData(lat, long, 1, 1, years)
+    if api_url:
+        weather.api_url = api_url
+
+    newest = newest_archive_date()
+    series = {}
+    for chunk in _chunk_years(years, chunk_years):
+        first, last = datetime.date(chunk[0], 1, 1), min(datetime.date(chunk[-1], 12, 31), newest)
+        if last < first:
+            continue
+        dates = [(first + datetime.timedelta(days=n)).isoformat() for n in range((last - first).days + 1)]
+        values = weather._parse_window(chunk[0], dates, timed_get(http, weather.archive_url(dates[0], dates[-1])))
+        if values is None:
+            raise ValueError(f'No daily data for {chunk[0]}-{chunk[-1]} at {weather.lat}, {weather.long}')
+        wanted = set(chunk)
+        series.update((date, value) for date, value in zip(dates, values) if int(date[:4]) in wanted)
+    return series
+
+
+def day_of_year_statistics(series: dict):
+    """
+    Summarises a daily series for every calendar day with <aggregate_values>, leaving out missing (None) values;
+    February 29 is summarised over leap years only
+    :param series: Dictionary of 'YYYY-MM-DD': dictionary of weather param: value, from <fetch_daily_series>
+    :return: Dictionary of (month, day): dictionary of each item of <VARIABLES>: dictionary of statistics
+    """
+    days = {}
+    for date, values in series.items():
+        columns = days.setdefault((int(date[5:7]), int(date[8:10])), {item: array('d') for item in VARIABLES})
+        for item in VARIABLES:
+            if values[item] is not None:
+                columns[item].append(values[item])
+
+    return {key: {item: aggregate_values(columns[item]) for item in VARIABLES} for key, columns in sorted(days.items())}
+
+
+def climatology_rows(lat: float, long: float, years: list, statistics: dict):
+    """
+    :param lat: Location Latitude, snapped to the archive grid
+    :param long: Location Longitude, snapped to the archive grid
+    :param years: Years summarised
+    :param statistics: Dictionary from <day_of_year_statistics>
+    :return: List of ClimatologyTable row dictionaries, one per calendar day
+    """
+    rows = []
+    for (month, day), aggregates in statistics.items():
+        row = dict(Latitude=lat, Longitude=long, Month=month, Day=day, First_Year=min(years), Last_Year=max(years),
+                   Years=aggregates[VARIABLES[0]]['count'])
+        for item, value in zip(VARIABLES, CLIMATOLOGY_VALUES):
+            row.update({f'{value}_{statistic}': aggregates[item][statistic] for statistic in CLIMATOLOGY_STATISTICS})
+        rows.append(row)
+    return rows
+
+
+def build_climatology(engine, lat: float, long: float, years: list = None, session=None,
+                      chunk_years: int = BATCH_CHUNK_YEARS, api_url: str = None, force: bool = False):
+    """
+    Precompute job: gathers the daily series of a location and stores its day-of-year statistics in Climatology.
+    A location already summarised over the same years is skipped unless <force> is set.
+    :param engine: sqlalchemy engine, from <database.create_weather_engine>, after <database.init_db>
+    :param lat: Location Latitude
+    :param long: Location Longitude
+    :param years: Years to summarise; defaults to <climatology_years>
+    :param session: Object with a get(url=...) method, as in <WeatherData.call_weather_api>
+    :param chunk_years: Maximum span of one API call, in years
+    :param api_url: Archive API endpoint to use instead of <WeatherData.api_url>
+    :param force: Gather and store again even if the location is already summarised
+    :return: Number of calendar days written
+    """
+    years = sorted(set(years or climatology_years()))
+    lat, long = snap_to_grid(lat, long)
+    db = sessionmaker(bind=engine)()
+    try:
+        if not force:
+            stored = db.execute(select(func.count()).select_from(ClimatologyTable).where(
+                ClimatologyTable.Latitude == lat, ClimatologyTable.Longitude == long,
+                ClimatologyTable.First_Year == years[0], ClimatologyTable.Last_Year == years[-1])).scalar()
+            if stored:
+                print(f'Climatology for {lat}, {long} over {years[0]}-{years[-1]} is already stored.')
+                return 0
+
+        series = fetch_daily_series(lat, long, years, session=session, chunk_years=chunk_years, api_url=api_url)
+        rows = climatology_rows(lat, long, years, day_of_year_statistics(series))
+        upsert_climatology_rows(db, rows)
+        db.commit()
+    finally:
+        db.close()
+
+    print(f'Climatology for {lat}, {long} over {years[0]}-{years[-1]} has been added to the table.')
+    return len(rows)
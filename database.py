@@ -1,6 +1,11 @@
-from sqlalchemy import Column, Integer, Float
+from sqlalchemy import Column, Integer, Float, Index, create_engine, event, select
+from sqlalchemy.dialects.sqlite import insert
 from sqlalchemy.orm import declarative_base
 
+from metrics import default_metrics
+from weather_grid import snap_to_grid
+from weather_sql import CLIMATOLOGY_COLUMNS, SUMMARY_VIEW
+
 base = declarative_base()
 
 
@@ -17,20 +22,235 @@ class WeatherTable(base):
     Day = Column(Integer)
     Year = Column(Integer)
 
-    # Temp and aggregate temp columns
+    # Daily Temp, Wind Speed, and Precipitation; aggregates are calculated when read, see <weather_sql.SUMMARY_COLUMNS>
     temp = Column(Float)
-    average_temperature = Column(Float)
-    max_temperature = Column(Float)
-    min_temperature = Column(Float)
-
-    # Wind Speed and aggregate Wind Speed columns
     wind_speed = Column(Float)
-    average_wind_speed = Column(Float)
-    max_wind_speed = Column(Float)
-    min_wind_speed = Column(Float)
-
-    # Precipitation and aggregate Precipitation columns
     precipitation = Column(Float)
-    sum_precipitation = Column(Float)
-    max_precipitation = Column(Float)
-    min_precipitation = Column(Float)
+
+    # One row per location, date, and year, so that runs can add to the table instead of replacing it. Locations
+    # are stored snapped to the archive grid (see <weather_grid.snap_to_grid>), so this is also the grid cell index.
+    __table_args__ = (
+        Index('uq_weather_location_date_year', 'Latitude', 'Longitude', 'Month', 'Day', 'Year', unique=True),
+    )
+
+
+class ClimatologyTable(base):
+    __tablename__ = 'Climatology'
+
+    # auto-incrementing integer as primary key
+    ID = Column(Integer, primary_key=True, autoincrement=True)
+
+    # Location, snapped to the archive grid, and calendar day
+    Longitude = Column(Float)
+    Latitude = Column(Float)
+    Month = Column(Integer)
+    Day = Column(Integer)
+
+    # Years summarised, and the number of them with data for the day
+    First_Year = Column(Integer)
+    Last_Year = Column(Integer)
+    Years = Column(Integer)
+
+    # Statistics of each daily value over the years, see <CLIMATOLOGY_COLUMNS>
+    temp_avg = Column(Float)
+    temp_min = Column(Float)
+    temp_max = Column(Float)
+    temp_std = Column(Float)
+    temp_p10 = Column(Float)
+    temp_p25 = Column(Float)
+    temp_p50 = Column(Float)
+    temp_p75 = Column(Float)
+    temp_p90 = Column(Float)
+    wind_speed_avg = Column(Float)
+    wind_speed_min = Column(Float)
+    wind_speed_max = Column(Float)
+    wind_speed_std = Column(Float)
+    wind_speed_p10 = Column(Float)
+    wind_speed_p25 = Column(Float)
+    wind_speed_p50 = Column(Float)
+    wind_speed_p75 = Column(Float)
+    wind_speed_p90 = Column(Float)
+    precipitation_avg = Column(Float)
+    precipitation_min = Column(Float)
+    precipitation_max = Column(Float)
+    precipitation_std = Column(Float)
+    precipitation_p10 = Column(Float)
+    precipitation_p25 = Column(Float)
+    precipitation_p50 = Column(Float)
+    precipitation_p75 = Column(Float)
+    precipitation_p90 = Column(Float)
+
+    # One row per location and calendar day, so that a lookup is a single index search
+    __table_args__ = (
+        Index('uq_climatology_location_date', 'Latitude', 'Longitude', 'Month', 'Day', unique=True),
+    )
+
+
+# PRAGMA settings applied to every connection opened by <create_weather_engine>: write-ahead logging lets queries
+# read while a run is writing, and synchronous=NORMAL only syncs to disk at checkpoints instead of every commit
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'temp_store': 'MEMORY',
+    'cache_size': -64000,
+}
+
+# Daily value columns of WeatherTable, updated when a stored location, date, and year is written again
+VALUE_COLUMNS = ['temp', 'wind_speed', 'precipitation']
+
+# Columns of Weather_Table before aggregates were moved to Weather_Summary
+_LEGACY_COLUMNS = {'average_temperature', 'sum_precipitation'}
+
+# Columns copied when Weather_Table rows are rebuilt by <init_db>
+_COPIED_COLUMNS = 'Longitude, Latitude, Month, Day, Year, temp, wind_speed, precipitation'
+
+
+def create_weather_engine(path: str = 'weather_data.db', pragmas: dict = None):
+    """
+    Creates sqlalchemy engine for a sqlite database with <SQLITE_PRAGMAS> applied to each connection
+    :param path: sqlite file
+    :param pragmas: PRAGMA name: value settings to use instead of <SQLITE_PRAGMAS>
+    :return: sqlalchemy engine
+    """
+    engine = create_engine(f'sqlite:///{path}')
+    settings = SQLITE_PRAGMAS if pragmas is None else pragmas
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in settings.items():
+            cursor.execute(f'PRAGMA {name} = {value};')
+        cursor.close()
+
+    return engine
+
+
+def init_db(engine):
+    """
+    Creates any missing tables, indexes, and the Weather_Summary view without dropping stored data.
+    A Weather_Table from before the split schema, with aggregate columns on every row, is rebuilt with only its
+    daily values, keeping the newest row for each location, date, and year. Locations stored before coordinates were
+    snapped to the archive grid are moved onto their grid cell.
+    :param engine: sqlalchemy engine for the database
+    """
+    with engine.begin() as connection:
+        columns = {row[1] for row in connection.exec_driver_sql('PRAGMA table_info(Weather_Table);')}
+        legacy = bool(columns & _LEGACY_COLUMNS)
+        if legacy:
+            connection.exec_driver_sql('DROP VIEW IF EXISTS Weather_Summary;')
+            connection.exec_driver_sql('DROP INDEX IF EXISTS uq_weather_location_date_year;')
+            connection.exec_driver_sql('ALTER TABLE Weather_Table RENAME TO Weather_Table_Legacy;')
+
+        base.metadata.create_all(connection)
+
+        if legacy:
+            connection.exec_driver_sql(
+                f'INSERT INTO Weather_Table ({_COPIED_COLUMNS}) SELECT {_COPIED_COLUMNS} FROM Weather_Table_Legacy '
+                f'WHERE ID IN '
+                f'(SELECT MAX(ID) FROM Weather_Table_Legacy GROUP BY Latitude, Longitude, Month, Day, Year) '
+                f'ORDER BY ID;')
+            connection.exec_driver_sql('DROP TABLE Weather_Table_Legacy;')
+
+        _snap_stored_locations(connection)
+        connection.exec_driver_sql(SUMMARY_VIEW)
+
+
+def _snap_stored_locations(connection):
+    """
+    Moves rows stored before coordinates were snapped to the archive grid onto the centre of their grid cell, keeping
+    the newest row when several locations in one cell stored the same date and year
+    :param connection: sqlalchemy connection, in a transaction
+    """
+    moved = []
+    for long, lat in connection.exec_driver_sql('SELECT DISTINCT Longitude, Latitude FROM Weather_Table;'):
+        snapped_lat, snapped_long = snap_to_grid(lat, long)
+        if (snapped_lat, snapped_long) != (lat, long):
+            moved.append((long, lat, snapped_long, snapped_lat))
+    if not moved:
+        return
+
+    connection.exec_driver_sql('CREATE TEMP TABLE Snapped_Locations (Longitude FLOAT, Latitude FLOAT, '
+                               'Snapped_Longitude FLOAT, Snapped_Latitude FLOAT);')
+    connection.exec_driver_sql('INSERT INTO Snapped_Locations VALUES (?, ?, ?, ?);', moved)
+    connection.exec_driver_sql(
+        f'INSERT INTO Weather_Table ({_COPIED_COLUMNS}) '
+        f'SELECT Snapped_Longitude, Snapped_Latitude, Month, Day, Year, temp, wind_speed, precipitation '
+        f'FROM Weather_Table JOIN Snapped_Locations USING (Longitude, Latitude) WHERE true ORDER BY ID DESC '
+        f'ON CONFLICT DO NOTHING;')
+    connection.exec_driver_sql('DELETE FROM Weather_Table WHERE (Longitude, Latitude) IN '
+                               '(SELECT Longitude, Latitude FROM Snapped_Locations);')
+    connection.exec_driver_sql('DROP TABLE Snapped_Locations;')
+
+
+def stored_years(session, lat: float, long: float, mon: int, day: int, years: list):
+    """
+    Reads the daily data already stored for a location and date
+    :param session: sqlalchemy session
+    :param lat: Location Latitude
+    :param long: Location Longitude
+    :param mon: Month
+    :param day: Day
+    :param years: Years to look for
+    :return: Dictionary of year: dictionary with the keys of <WeatherData.weather_info> items, for stored years
+    """
+    statement = select(WeatherTable.Year, WeatherTable.temp, WeatherTable.wind_speed, WeatherTable.precipitation).where(
+        WeatherTable.Latitude == lat, WeatherTable.Longitude == long,
+        WeatherTable.Month == mon, WeatherTable.Day == day, WeatherTable.Year.in_(years))
+
+    return {
+        year: {
+            "year": year,
+            "mean_temperature": temp,
+            "max_wind_speed": wind_speed,
+            "sum_precipitation": precipitation
+        }
+        for year, temp, wind_speed, precipitation in session.execute(statement)
+    }
+
+
+def upsert_weather_rows(session, rows: list):
+    """
+    Inserts many rows into Weather_Table with one executemany statement; rows whose location, date, and year are
+    already stored have their daily values replaced. The caller commits, so that a whole run is written in one
+    transaction.
+    :param session: sqlalchemy session
+    :param rows: List of dictionaries of WeatherTable column: value, all with the same columns
+    """
+    if not rows:
+        return
+    statement = insert(WeatherTable)
+    updates = {column: statement.excluded[column] for column in VALUE_COLUMNS if column in rows[0]}
+    if updates:
+        statement = statement.on_conflict_do_update(
+            index_elements=['Latitude', 'Longitude', 'Month', 'Day', 'Year'], set_=updates)
+    else:
+        statement = statement.on_conflict_do_nothing(index_elements=['Latitude', 'Longitude', 'Month', 'Day', 'Year'])
+    with default_metrics.timer('db.upsert_seconds'):
+        session.execute(statement, rows)
+    default_metrics.count('db.rows_written', len(rows))
+
+
+def upsert_weather_row(session, row: dict):
+    """
+    Inserts a single row into Weather_Table, as <upsert_weather_rows>
+    :param session: sqlalchemy session
+    :param row: Dictionary of WeatherTable column: value
+    """
+    upsert_weather_rows(session, [row])
+
+
+def upsert_climatology_rows(session, rows: list):
+    """
+    Inserts rows into Climatology with one executemany statement, replacing the statistics of a location and calendar
+    day that is already stored. The caller commits.
+    :param session: sqlalchemy session
+    :param rows: List of dictionaries of ClimatologyTable column: value, all with the same columns
+    """
+    if not rows:
+        return
+    statement = insert(ClimatologyTable)
+    statement = statement.on_conflict_do_update(
+        index_elements=['Latitude', 'Longitude', 'Month', 'Day'],
+        set_={column: statement.excluded[column] for column in ['First_Year', 'Last_Year', 'Years',
+                                                                 *CLIMATOLOGY_COLUMNS]})
+    session.execute(statement, rows)
@@ -1,182 +1,450 @@
 # Import external libraries
+import argparse
+import csv
+import json
 import sqlite3
-from tabulate import tabulate
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
 import sys
+import time
+from contextlib import contextmanager
 
-# Import internal libraries
-from weather_data import WeatherData
-from database import base, WeatherTable
-
-# Ask user if they want to use the default parameters or their own parameters
-check_default = input('Would you like to use default parameters? y/n: ')
-
-# If default, create variables for New Orleans, Louisiana, for the past 5 Halloweens
-if check_default == 'y':
-    latitude, longitude = 29.9547, -90.0751
-    month, day = 10, 31
-    years = [2020, 2021, 2022, 2023, 2024]
-    print('Creating table for weather data from the past 5 Halloweens from New Orleans, Louisiana.')
-
-# If user decides to use their own parameters, ask for parameters. If no parameter is given, default to above parameter
-elif check_default == 'n':
-    print('You will be prompted to add your own location and date information. You can still use the default settings '
-          'if you press Enter without typing anything for each statement. '
-          'The default information is as follows:\n\n'
-          'Latitude: 29.9547, Longitude: -90.0751; New Orleans, Louisiana\n'
-          'Date: October 31; Halloween\n'
-          'Years: Past 5 years from 2025; 2020, 2021, 2022, 2023, 2024.\n\n'
-          'If you would like to use the default information, press Enter without making any input.')
-
-    # Create variables for location (New Orleans, Louisiana) and dates (past 5 Halloweens)
-    # Request input or use default values if no input is made.
-    latitude = float(input('Type the desired Latitude or press Enter for default: ') or 29.9547)
-    longitude = float(input('Type the desired Longitude or press Enter for default: ') or -90.0751)
-    month = int(input('Type the desired Month as a number (ie. for October, type "10") or press Enter for default: ')
-                or 10)
-    day = int(input('Type the desired Day or press Enter for default: ') or 31)
-    num_years = int(input('Type the number of years you want to see data for or Enter for default: ') or 5)
-    last_year = int(input('Type the last year you want to see data for (ie. default is 2024): ') or 2024)
-    years = []
-
-    # Create the years list to access API data. If any date before January 1st, 1940 is added to the years list,
-    # halt the program, as attempting to gather data from that date will result in an error, as the WeatherData class
-    # has methods that aggregate data from each year, and type: None cannot be aggregated.
-    for year in range(0, num_years):
-        if last_year < 1940:
-            sys.exit('The earliest year in the API database is 1940. Please ensure that any date before January 1st, '
-                     '1940 is not included in the years you are checking.')
-        years.append(last_year)
-        last_year -= 1
-    years.reverse()
-
-# If user makes no input, use default parameters
-else:
-    latitude, longitude = 29.9547, -90.0751
-    month, day = 10, 31
-    years = [2020, 2021, 2022, 2023, 2024]
-    print('No input was made. Using default parameters: New Orleans, Louisiana, for the past 5 Halloweens.')
-
-print('\nProcessing...')
-
-# Instance WeatherData class and call api
-weather = WeatherData(latitude, longitude, month, day, years)
-yearly_weather = weather.call_weather_api()
-
-engine = create_engine('sqlite:///weather_data.db')
-
-# CREATE OR REPLACE engine
-base.metadata.drop_all(engine)
-base.metadata.create_all(engine)
-
-Session = sessionmaker(bind=engine)
-session = Session()
-
-# Populate WeatherTable table with API data
-for year_data in yearly_weather:
-    row = WeatherTable(
-        Latitude=latitude,
-        Longitude=longitude,
-        Month=month,
-        Day=day,
-        Year=year_data['year'],
-
-        temp=year_data['mean_temperature'],
-        average_temperature=weather.get_temp('avg'),
-        min_temperature=weather.get_temp('min'),
-        max_temperature=weather.get_temp('max'),
-
-        wind_speed=year_data['max_wind_speed'],
-        average_wind_speed=weather.get_wind_speed('avg'),
-        max_wind_speed=weather.get_wind_speed('max'),
-        min_wind_speed=weather.get_wind_speed('min'),
-
-        precipitation=year_data['sum_precipitation'],
-        sum_precipitation=weather.get_precipitation('sum'),
-        max_precipitation=weather.get_precipitation('max'),
-        min_precipitation=weather.get_precipitation('min')
-    )
-    session.add(row)
-
-print('Data has been added to the table.')
-session.commit()
-session.close()
-
-
-def query_table(lat: float, long: float, mon: int, da: int):
-    """
-    Connects to sqlite database <weather_data.db> defined above. Creates table in terminal with headers using
-    SQL SELECT statement
-    :param lat: Location Latitude
-    :param long: Location Longitude
-    :param mon: Month
-    :param da: Day, as 'day' was already in use
-    :return: SELECT * FROM Weather_Table WHERE Latitude = lat AND Longitude = long AND Month = mon AND Day = da;
-    """
-    # Connect to database
-    connection = sqlite3.connect('weather_data.db')
-    cursor = connection.cursor()
-
-    # Create SQL statement to form table from database
-    query = (
-        f'SELECT * FROM Weather_Table WHERE Latitude = ? AND Longitude = ? AND Month = ? AND Day = ?;')
-    cursor.execute(query, (lat, long, mon, da))
-    full_weather = cursor.fetchall()
-
-    # If database is successfully queried, create table in console with headers
-    if full_weather:
-        headers = ['ID', 'Month', 'Day', 'Year',
-                   'Daily_Temp (F)', 'Avg_Temp (F)', 'Max_Temp (F)', 'Min_Temp (F)',
-                   'Daily_Wind_Speed (mph)', 'Avg_Wind_Speed (mph)', 'Max_Wind_Speed (mph)', 'Min_Wind_Speed (mph)',
-                   'Daily_Precipitation (inches)', 'Sum_Precipitation (inches)',
-                   'Max_Precipitation (inches)', 'Min_Precipitation (inches)']
-        table_data = []
-
-        for item in full_weather:
-            table_data.append([
-                item[0],  # ID
-                item[3],  # Month
-                item[4],  # Day
-                item[5],  # Year
-
-                item[6],  # Single Day's Temp
-                item[7],  # Average Temp
-                item[8],  # Maximum Temp
-                item[9],  # Minimum Temp
-
-                item[10],  # Single Day's Max Wind Speed
-                item[11],  # Average Wind Speed
-                item[12],  # Maximum Wind Speed
-                item[13],  # Minimum Wind Speed
-
-                item[14],  # Single Day's Precipitation
-                item[15],  # Total Precipitation
-                item[16],  # Maximum Precipitation
-                item[17]  # Minimum Precipitation
-            ])
-
-        # Print table to console
-        print(tabulate(table_data, headers=headers, tablefmt='grid'))
-
-        cursor.close()
-        connection.close()
+# Import internal libraries. Libraries used to gather and store data (requests, sqlalchemy) are imported by the
+# functions that use them, so that read-only queries start without loading them.
+from metrics import default_metrics, profile
+from query import export_query, query_climatology, query_table
+from weather_grid import snap_to_grid
+
+# Default parameters: New Orleans, Louisiana, for the past 5 Halloweens
+DEFAULT_LATITUDE, DEFAULT_LONGITUDE = 29.9547, -90.0751
+DEFAULT_MONTH, DEFAULT_DAY = 10, 31
+DEFAULT_YEARS = [2020, 2021, 2022, 2023, 2024]
+
+# The earliest year in the API database
+FIRST_ARCHIVE_YEAR = 1940
+
+
+def prompt_parameters():
+    """
+    Asks user whether to use the default parameters or their own parameters
+    :return: (latitude, longitude, month, day, years)
+    """
+    # Ask user if they want to use the default parameters or their own parameters
+    check_default = input('Would you like to use default parameters? y/n: ')
+
+    # If default, create variables for New Orleans, Louisiana, for the past 5 Halloweens
+    if check_default == 'y':
+        print('Creating table for weather data from the past 5 Halloweens from New Orleans, Louisiana.')
+        return DEFAULT_LATITUDE, DEFAULT_LONGITUDE, DEFAULT_MONTH, DEFAULT_DAY, list(DEFAULT_YEARS)
+
+    # If user decides to use their own parameters, ask for parameters. If no parameter is given, default to above
+    # parameter
+    elif check_default == 'n':
+        print('You will be prompted to add your own location and date information. You can still use the default '
+              'settings if you press Enter without typing anything for each statement. '
+              'The default information is as follows:\n\n'
+              'Latitude: 29.9547, Longitude: -90.0751; New Orleans, Louisiana\n'
+              'Date: October 31; Halloween\n'
+              'Years: Past 5 years from 2025; 2020, 2021, 2022, 2023, 2024.\n\n'
+              'If you would like to use the default information, press Enter without making any input.')
+
+        # Create variables for location (New Orleans, Louisiana) and dates (past 5 Halloweens)
+        # Request input or use default values if no input is made.
+        latitude = float(input('Type the desired Latitude or press Enter for default: ') or DEFAULT_LATITUDE)
+        longitude = float(input('Type the desired Longitude or press Enter for default: ') or DEFAULT_LONGITUDE)
+        month = int(input('Type the desired Month as a number (ie. for October, type "10") or press Enter for '
+                          'default: ') or DEFAULT_MONTH)
+        day = int(input('Type the desired Day or press Enter for default: ') or DEFAULT_DAY)
+        num_years = int(input('Type the number of years you want to see data for or Enter for default: ') or 5)
+        last_year = int(input('Type the last year you want to see data for (ie. default is 2024): ') or 2024)
+
+        # Create the years list to access API data. If any date before January 1st, 1940 is added to the years list,
+        # halt the program, as attempting to gather data from that date will result in an error, as the WeatherData
+        # class has methods that aggregate data from each year, and type: None cannot be aggregated.
+        try:
+            years = make_years(num_years, last_year)
+        except ValueError as e:
+            sys.exit(str(e))
+        return latitude, longitude, month, day, years
+
+    # If user makes no input, use default parameters
     else:
-        print('Error')
+        print('No input was made. Using default parameters: New Orleans, Louisiana, for the past 5 Halloweens.')
+        return DEFAULT_LATITUDE, DEFAULT_LONGITUDE, DEFAULT_MONTH, DEFAULT_DAY, list(DEFAULT_YEARS)
+
+
+def make_years(num_years: int, last_year: int):
+    """
+    :param num_years: Number of years
+    :param last_year: Last year
+    :return: List of <num_years> years ending with <last_year>; raises ValueError if any is before 1940
+    """
+    if last_year - num_years + 1 < FIRST_ARCHIVE_YEAR:
+        raise ValueError('The earliest year in the API database is 1940. Please ensure that any date before January '
+                         '1st, 1940 is not included in the years you are checking.')
+    return list(range(last_year - num_years + 1, last_year + 1))
+
+
+def parse_years(venue: dict):
+    """
+    Reads the years of a venue from either a 'years' item, as a list, a 'first-last' range, or years separated by
+    spaces or semicolons, or from 'num_years' and 'last_year' items, as asked by <prompt_parameters>
+    :param venue: Dictionary read from a venue file
+    :return: List of years
+    """
+    years = venue.get('years')
+    if isinstance(years, list):
+        parsed = [int(year) for year in years]
+    elif years:
+        text = str(years).strip()
+        if '-' in text:
+            first, last = (int(part) for part in text.split('-'))
+            parsed = list(range(first, last + 1))
+        else:
+            parsed = [int(year) for year in text.replace(';', ' ').split()]
+    else:
+        return make_years(int(venue.get('num_years') or 5), int(venue.get('last_year') or 2024))
+
+    if min(parsed) < FIRST_ARCHIVE_YEAR:
+        raise ValueError(f'The earliest year in the API database is {FIRST_ARCHIVE_YEAR}: {years}')
+    return parsed
 
 
-print()
-# Print statement for table information showing location and date
+def load_venues(path: str):
+    """
+    Reads venues and dates from a CSV file with a header row, or a JSON file holding a list of objects. Each venue
+    has latitude, longitude, month, day, and years as read by <parse_years>.
+    :param path: .csv or .json file
+    :return: List of FetchJob
+    """
+    from weather_fetch import FetchJob
+
+    with open(path, newline='') as file:
+        if path.lower().endswith('.json'):
+            venues = json.load(file)
+        else:
+            venues = list(csv.DictReader(file))
+
+    jobs = []
+    for number, venue in enumerate(venues, start=1):
+        try:
+            jobs.append(FetchJob(float(venue['latitude']), float(venue['longitude']), int(venue['month']),
+                                 int(venue['day']), parse_years(venue)))
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f'{path}: venue {number} is not valid: {e}') from e
+    return jobs
+
+
+class StageTimer:
+    """
+    Adds up time spent in each stage of a run; each stage is also observed into <metrics.default_metrics> as
+    'stage.<name>'
+
+    Methods:
+        stage(self, name):
+            context manager adding the time spent inside it to stage <name>
+        report(self):
+            prints each stage with its total seconds
+    """
+
+    def __init__(self):
+        self.seconds = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+            default_metrics.observe(f'stage.{name}', seconds)
 
-if latitude == 29.9547 and longitude == -90.0751:
-    if month == 10 and day == 31:
-        print(f'Weather data for Halloween data in New Orleans for years: {years}')
+    def report(self):
+        print('\nStage timings:')
+        for name, seconds in self.seconds.items():
+            print(f'  {name}: {seconds:.3f} s')
+        print(f'  total: {sum(self.seconds.values()):.3f} s')
+
+
+def ingest(engine, jobs: list, cache=None, client=None, workers: int = 8, timer: StageTimer = None,
+           pipeline: bool = False):
+    """
+    Gathers every year of every job that is not already stored and adds it to Weather_Table in one transaction, or,
+    in pipeline mode, streams it to a <pipeline.RowWriter> committing in batches while later jobs are still fetched
+    :param engine: sqlalchemy engine, from <create_weather_engine>
+    :param jobs: List of FetchJob
+    :param cache: <weather_cache.ResponseCache> or None
+    :param client: <weather_fetch.ArchiveClient> shared by every request; created if not given
+    :param workers: Number of locations gathered at the same time
+    :param timer: StageTimer to record stages in
+    :param pipeline: Overlap fetching and storing, keeping memory flat for large runs
+    :return: Number of rows written
+    """
+    from sqlalchemy.orm import sessionmaker
+    from database import stored_years, upsert_weather_rows
+    from pipeline import RowWriter
+    from weather_fetch import dedupe_jobs, fetch_many
+
+    timer = timer or StageTimer()
+    session = sessionmaker(bind=engine)()
+
+    # Only years that are not already stored need to be gathered from the weather API, once for each grid cell;
+    # venues in the same cell share its rows
+    with timer.stage('check stored'):
+        missing = []
+        for job in dedupe_jobs(jobs):
+            stored = stored_years(session, job.latitude, job.longitude, job.month, job.day, job.years)
+            missing_years = [year for year in job.years if year not in stored]
+            if missing_years:
+                missing.append(job._replace(years=missing_years))
+    session.close()
+
+    if not missing:
+        print('All years are already stored; skipping weather API.')
+
+    # Populate WeatherTable table with the daily data gathered from API; aggregates are calculated by query_table
+    # when the table is read. The write rate is measured over storing only, not over waiting for the API.
+    batches = weather_rows(fetch_many(missing, workers=workers, client=client, cache=cache))
+    if pipeline:
+        with timer.stage('fetch and store'), RowWriter(engine) as writer:
+            for job_rows in batches:
+                writer.put(job_rows)
+            written = writer.close()
+        store_seconds = writer.seconds
     else:
-        print(f'Weather data for date {month}, {day} in New Orleans for years: {years}')
-elif month == 10 and day == 31 and not (latitude == 29.9547 and longitude == -90.0751):
-    print(f'Weather data for Halloween data in location: {latitude}, {longitude} for years: {years}')
-else:
-    print(f'Weather data for date {month}, {day} in location: {latitude}, {longitude} for years: {years}')
-
-# Finally, call query function
-query_table(latitude, longitude, month, day)
+        with timer.stage('fetch'):
+            rows = [row for job_rows in batches for row in job_rows]
+        start = time.perf_counter()
+        with timer.stage('store'):
+            session = sessionmaker(bind=engine)()
+            upsert_weather_rows(session, rows)
+            with default_metrics.timer('db.commit_seconds'):
+                session.commit()
+            session.close()
+        store_seconds = time.perf_counter() - start
+        written = len(rows)
+    if written:
+        default_metrics.set('db.rows_per_second', written / store_seconds)
+
+    print('Data has been added to the table.')
+    return written
+
+
+def weather_rows(results):
+    """
+    Turns fetched results into Weather_Table rows, printing the jobs that failed
+    :param results: Iterable of <weather_fetch.FetchResult>
+    :return: Generator of lists of WeatherTable row dictionaries, one list per successful result
+    """
+    for result in results:
+        if result.error is not None:
+            print(f'Failed to retrieve data; {result.job}: {result.error}')
+            continue
+        yield [dict(
+            Latitude=result.weather.lat,
+            Longitude=result.weather.long,
+            Month=result.job.month,
+            Day=result.job.day,
+            Year=year_data['year'],
+            temp=year_data['mean_temperature'],
+            wind_speed=year_data['max_wind_speed'],
+            precipitation=year_data['sum_precipitation']
+        ) for year_data in result.weather.weather_series]
+
+
+def describe(latitude: float, longitude: float, month: int, day: int, years: list):
+    """
+    Print statement for table information showing location and date
+    """
+    if years is None:
+        years = 'every stored year'
+    if latitude == DEFAULT_LATITUDE and longitude == DEFAULT_LONGITUDE:
+        if month == 10 and day == 31:
+            print(f'Weather data for Halloween data in New Orleans for years: {years}')
+        else:
+            print(f'Weather data for date {month}, {day} in New Orleans for years: {years}')
+    elif month == 10 and day == 31:
+        print(f'Weather data for Halloween data in location: {latitude}, {longitude} for years: {years}')
+    else:
+        print(f'Weather data for date {month}, {day} in location: {latitude}, {longitude} for years: {years}')
+
+
+def parse_args(argv: list = None):
+    parser = argparse.ArgumentParser(
+        description='Gather historical weather data into a sqlite database and show it. Without --venues, asks for '
+                    'one location and date.')
+    parser.add_argument('--venues', help='CSV or JSON file of venues: latitude, longitude, month, day, and years '
+                                         '(or num_years and last_year)')
+    parser.add_argument('--db', default='weather_data.db', help='sqlite database file (default: weather_data.db)')
+    parser.add_argument('--cache', default='weather_cache.db', help='response cache file (default: weather_cache.db)')
+    parser.add_argument('--no-cache', action='store_true', help='do not use the response cache')
+    parser.add_argument('--workers', type=int, default=8, help='venues gathered at the same time (default: 8)')
+    parser.add_argument('--rate', type=float, default=5.0, help='maximum API requests per second (default: 5)')
+    parser.add_argument('--pipeline', action='store_true', help='store rows in batches while later venues are still '
+                                                                 'being gathered, keeping memory flat for large runs')
+    parser.add_argument('--metrics', metavar='FILE', help='write request latencies, retries, errors, bytes, and '
+                                                          'database and query timings to a JSON file')
+    parser.add_argument('--profile', metavar='FILE', help='run under cProfile, including fetch and writer threads, and '
+                                                          'write their combined statistics to FILE')
+    parser.add_argument('--quiet', action='store_true', help='do not print a table for each venue')
+    parser.add_argument('--timings', action='store_true', help='print time spent in each stage')
+    parser.add_argument('--export', metavar='FILE', help='stream the stored rows of every venue, or of --region, into '
+                                                         'a .csv, .jsonl, or .parquet file instead of printing tables')
+    parser.add_argument('--format', choices=['csv', 'jsonl', 'parquet'], help='export format, if not the extension '
+                                                                              'of the --export file')
+    parser.add_argument('--query', type=float, nargs=4, metavar=('LAT', 'LONG', 'MONTH', 'DAY'),
+                        help='show stored data for one location and date without gathering new data')
+    parser.add_argument('--years', type=int, nargs='+',
+                        help='with --query, years to show; default is every stored year')
+    parser.add_argument('--read-only', action='store_true', help='with --venues, show stored data without gathering '
+                                                                  'new data')
+    parser.add_argument('--climatology', action='store_true',
+                        help='gather and show day-of-year statistics of each venue over the 30 most recent complete '
+                             'years instead of its daily rows; with --query, show the stored statistics')
+    parser.add_argument('--region', type=float, nargs=4, metavar=('MIN_LAT', 'MAX_LAT', 'MIN_LONG', 'MAX_LONG'),
+                        help='with --export, export every stored location inside these bounds without gathering '
+                             'new data')
+    return parser.parse_args(argv)
+
+
+def gather(args, jobs: list, timer: StageTimer):
+    """
+    Gathers and stores every job with one engine, API session, and cache
+    """
+    from database import create_weather_engine, init_db
+    from weather_cache import ResponseCache
+    from weather_fetch import ArchiveClient
+
+    print('\nProcessing...')
+
+    # One engine, API session, and cache for every venue; CREATE IF NOT EXISTS, data stored by previous runs is kept
+    with timer.stage('open database'):
+        engine = create_weather_engine(args.db)
+        init_db(engine)
+    cache = None if args.no_cache else ResponseCache(args.cache)
+    client = ArchiveClient(requests_per_second=args.rate)
+
+    try:
+        if args.climatology:
+            gather_climatology(engine, jobs, client, timer)
+        else:
+            ingest(engine, jobs, cache=cache, client=client, workers=args.workers, timer=timer,
+                   pipeline=args.pipeline)
+    finally:
+        if cache is not None:
+            cache.close()
+        engine.dispose()
+
+
+def gather_climatology(engine, jobs: list, client, timer: StageTimer):
+    """
+    Stores the day-of-year statistics of the grid cell of every job, once per cell
+    :param engine: sqlalchemy engine, from <create_weather_engine>
+    :param jobs: List of FetchJob
+    :param client: <weather_fetch.ArchiveClient> to send requests through
+    :param timer: StageTimer to record stages in
+    """
+    from climatology import build_climatology
+
+    with timer.stage('climatology'):
+        for latitude, longitude in dict.fromkeys(snap_to_grid(job.latitude, job.longitude) for job in jobs):
+            try:
+                build_climatology(engine, latitude, longitude, session=client)
+            except (OSError, ValueError) as e:
+                print(f'Failed to retrieve data; {latitude}, {longitude}: {e}')
+
+
+def show(args, jobs: list, timer: StageTimer):
+    """
+    Finally, call query function for each job, or export every job's rows into one file
+    :param args: Parsed command-line arguments
+    :param jobs: List of (latitude, longitude, month, day, years)
+    :param timer: StageTimer to record stages in
+    """
+    if args.climatology and not args.quiet:
+        with timer.stage('query'):
+            for latitude, longitude, month, day, _ in jobs:
+                print(f'\nTypical weather for date {month}, {day} in location: {latitude}, {longitude}')
+                query_climatology(latitude, longitude, month, day, path=args.db)
+    elif args.export:
+        with timer.stage('export'):
+            # Venues in the same grid cell share their rows, which are exported once
+            cells = dict.fromkeys((*snap_to_grid(latitude, longitude), month, day, years and tuple(years))
+                                  for latitude, longitude, month, day, years in jobs)
+            selections = [dict(lat=latitude, long=longitude, mon=month, da=day, years=years)
+                          for latitude, longitude, month, day, years in cells]
+            count = export_query(args.export, args.format, selections=selections, path=args.db)
+        print(f'Exported {count} rows to {args.export}.')
+    elif not args.quiet:
+        with timer.stage('query'):
+            for job in jobs:
+                print()
+                describe(*job)
+                query_table(*job, path=args.db)
+
+
+def main(argv: list = None):
+    args = parse_args(argv)
+    try:
+        with profile(args.profile):
+            run(args, StageTimer())
+    finally:
+        if args.metrics:
+            default_metrics.write_json(args.metrics)
+            print(f'Metrics written to {args.metrics}.')
+        if args.profile:
+            print(f'Profile written to {args.profile}; read it with: python -m pstats {args.profile}')
+
+
+def run(args, timer: StageTimer):
+    """
+    Runs the lookup, export, or gather requested by the command-line arguments
+    :param args: Parsed command-line arguments
+    :param timer: StageTimer to record stages in
+    """
+    if args.climatology and (args.export or args.region):
+        sys.exit('--climatology cannot be exported')
+
+    # Read-only lookups: export every stored location of a region, or show one location and date
+    if args.region or args.query:
+        if args.region and not args.export:
+            sys.exit('--region needs --export FILE')
+        try:
+            if args.region:
+                with timer.stage('export'):
+                    count = export_query(args.export, args.format, region=tuple(args.region), path=args.db)
+                print(f'Exported {count} rows to {args.export}.')
+            else:
+                latitude, longitude, month, day = args.query
+                show(args, [(latitude, longitude, int(month), int(day), args.years)], timer)
+        except sqlite3.OperationalError as e:
+            sys.exit(f'Could not read {args.db}: {e}')
+        if args.timings:
+            timer.report()
+        return
+
+    if args.venues:
+        with timer.stage('load venues'):
+            try:
+                jobs = load_venues(args.venues)
+            except (OSError, ValueError) as e:
+                sys.exit(str(e))
+        print(f'Loaded {len(jobs)} venues from {args.venues}.')
+    else:
+        from weather_fetch import FetchJob
+
+        jobs = [FetchJob(*prompt_parameters())]
+
+    if not args.read_only:
+        gather(args, jobs, timer)
+
+    try:
+        show(args, jobs, timer)
+    except sqlite3.OperationalError as e:
+        sys.exit(f'Could not read {args.db}: {e}')
+
+    if args.timings or args.venues:
+        timer.report()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# Run instrumentation, using the standard library only so that every module, including the read-only query path,
+# can record into it. The fetch, store, and query hot paths record into <default_metrics>:
+#
+#   http.request_seconds          network latency of each attempt that got a response   (histogram)
+#   http.rate_limit_wait_seconds  wait for the ArchiveClient rate limiter, per attempt  (histogram)
+#   http.backoff_seconds          sleep before each retry                               (histogram)
+#   http.requests                 archive API calls, not counting retries               (counter)
+#   http.status.<code>            attempts answered with each status code               (counter)
+#   http.retries                  attempts retried by ArchiveClient                     (counter)
+#   http.connection_errors        attempts that got no response                         (counter)
+#   http.bytes_received           body bytes of the final response of each call         (counter)
+#   parse.errors                  responses without usable daily data                   (counter)
+#   db.upsert_seconds             upsert statements                                     (histogram)
+#   db.commit_seconds             commits of gathered rows                              (histogram)
+#   db.rows_written               rows upserted                                         (counter)
+#   db.rows_per_second            rows written per second spent storing, last ingest    (gauge)
+#   query.seconds                 query_table and export_query calls                    (histogram)
+#   query.rows_read               rows read by them                                     (counter)
+#   stage.<name>                  main.py stages, from StageTimer                       (histogram)
+#
+# <Metrics.summary> gives everything as a JSON-ready dictionary; hooks added with <Metrics.add_hook> see every value
+# as it is recorded, to forward it to another metrics system.
+
+# Upper bounds of the histogram buckets, in milliseconds; values above the last bound are counted in an overflow bucket
+LATENCY_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Histogram:
+    """
+    Bucketed distribution of durations, with count, total, min, and max kept exactly
+
+    Methods:
+        observe(self, seconds):
+            adds a duration
+        summary(self):
+            returns dictionary of count, sum_ms, mean_ms, min_ms, max_ms, estimated p50_ms, p95_ms, and p99_ms (the
+            upper bound of the bucket the percentile falls in), and buckets: dictionary of '<=bound' label: count
+    """
+
+    def __init__(self, bounds: tuple = LATENCY_BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.low = None
+        self.high = None
+
+    def observe(self, seconds: float):
+        milliseconds = seconds * 1000
+        self.counts[bisect.bisect_left(self.bounds, milliseconds)] += 1
+        self.count += 1
+        self.total += milliseconds
+        self.low = milliseconds if self.low is None else min(self.low, milliseconds)
+        self.high = milliseconds if self.high is None else max(self.high, milliseconds)
+
+    def _percentile(self, percentile: float):
+        rank = percentile / 100 * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.high)
+        return self.high
+
+    def summary(self):
+        labels = [f'<={bound}' for bound in self.bounds] + [f'>{self.bounds[-1]}']
+        return {
+            'count': self.count,
+            'sum_ms': self.total,
+            'mean_ms': self.total / self.count if self.count else None,
+            'min_ms': self.low,
+            'max_ms': self.high,
+            'p50_ms': self._percentile(50) if self.count else None,
+            'p95_ms': self._percentile(95) if self.count else None,
+            'p99_ms': self._percentile(99) if self.count else None,
+            'buckets': {label: count for label, count in zip(labels, self.counts) if count},
+        }
+
+
+class Metrics:
+    """
+    Thread-safe registry of counters, gauges, and duration histograms
+
+    Methods:
+        count(self, name, amount):
+            adds amount to counter name
+        set(self, name, value):
+            sets gauge name to value
+        observe(self, name, seconds):
+            adds a duration to histogram name
+        timer(self, name):
+            context manager observing the time spent in its block into histogram name
+        add_hook(self, hook); remove_hook(self, hook):
+            hook(kind, name, value) is called for every recorded value, kind being 'count', 'set', or 'observe'
+        summary(self):
+            returns dictionary of counters, gauges, and histogram summaries
+        write_json(self, path):
+            writes <summary> to a JSON file
+        reset(self):
+            clears every recorded value; hooks are kept
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hooks = []
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.gauges = {}
+            self.histograms = {}
+            self.started = time.time()
+
+    def add_hook(self, hook):
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self._hooks.remove(hook)
+
+    def count(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+        self._notify('count', name, amount)
+
+    def set(self, name: str, value: float):
+        with self._lock:
+            self.gauges[name] = value
+        self._notify('set', name, value)
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+        self._notify('observe', name, seconds)
+
+    @contextmanager
+    def timer(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def _notify(self, kind: str, name: str, value: float):
+        for hook in self._hooks:
+            hook(kind, name, value)
+
+    def summary(self):
+        with self._lock:
+            return {
+                'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+                'seconds': time.time() - self.started,
+                'counters': dict(sorted(self.counters.items())),
+                'gauges': dict(sorted(self.gauges.items())),
+                'histograms': {name: histogram.summary() for name, histogram in sorted(self.histograms.items())},
+            }
+
+    def write_json(self, path: str):
+        with open(path, 'w') as file:
+            json.dump(self.summary(), file, indent=2)
+
+
+# Registry the fetch, store, and query code records into
+default_metrics = Metrics()
+
+
+@contextmanager
+def profile(path: str = None):
+    """
+    Runs the block under cProfile, for finding hot spots that the metrics above only narrow down. cProfile only sees
+    the thread it is enabled in, so every thread started inside the block, such as the workers of
+    <weather_fetch.fetch_many> and the <pipeline.RowWriter> thread, gets its own profiler, and their statistics are
+    added together when the block ends.
+    :param path: File to dump pstats data into, readable with pstats or snakeviz; nothing is profiled if None
+    """
+    if path is None:
+        yield None
+        return
+    import cProfile
+    import pstats
+    import sys
+
+    profilers = []
+    lock = threading.Lock()
+
+    def profile_thread(frame, event, arg):
+        # Called once in each new thread, before it runs; the thread's profiler replaces this function
+        sys.setprofile(None)
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Only one profiler can be active at a time where cProfile uses sys.monitoring, and that one already
+            # sees every thread
+            return
+        with lock:
+            profilers.append(profiler)
+
+    main_profiler = cProfile.Profile()
+    threading.setprofile(profile_thread)
+    main_profiler.enable()
+    try:
+        yield main_profiler
+    finally:
+        main_profiler.disable()
+        threading.setprofile(None)
+        stats = pstats.Stats(main_profiler)
+        with lock:
+            for profiler in profilers:
+                profiler.create_stats()
+                if profiler.stats:
+                    stats.add(profiler)
+        stats.dump_stats(path)
@@ -0,0 +1,133 @@
+import datetime
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from weather_data import newest_archive_date
+
+
+def archive_daily(lat: float, long: float, start: datetime.date, end: datetime.date):
+    """
+    Creates archive-shaped daily data; values are derived from the date and location, so that repeated requests for
+    the same day always agree, whatever range they are requested in
+    :param lat: Location Latitude
+    :param long: Location Longitude
+    :param start: First date
+    :param end: Last date
+    :return: Dictionary like the 'daily' item of an archive API response
+    """
+    seed = lat + long
+    dates = [start + datetime.timedelta(days=n) for n in range((end - start).days + 1)]
+    return {
+        'time': [date.isoformat() for date in dates],
+        'temperature_2m_mean': [round(60 + (date.toordinal() % 17) + seed % 5, 1) for date in dates],
+        'wind_speed_10m_max': [round(5 + (date.toordinal() % 11), 1) for date in dates],
+        'precipitation_sum': [round((date.toordinal() % 7) / 10, 2) for date in dates],
+    }
+
+
+def archive_response(query: str, newest: datetime.date = None):
+    """
+    :param query: Query string of an archive API URL
+    :param newest: Newest date in the archive; defaults to <weather_data.newest_archive_date>
+    :return: Dictionary like an archive API response for the requested location and dates; raises ValueError, as
+    the archive answers 400, if the end date is after newest
+    """
+    params = {key: value[0] for key, value in parse_qs(query).items()}
+    lat, long = float(params['latitude']), float(params['longitude'])
+    start = datetime.date.fromisoformat(params['start_date'])
+    end = datetime.date.fromisoformat(params['end_date'])
+    newest = newest or newest_archive_date()
+    if end > newest:
+        raise ValueError(f"Parameter 'end_date' is out of allowed range from 1940-01-01 to {newest.isoformat()}")
+    return {'latitude': lat, 'longitude': long, 'daily': archive_daily(lat, long, start, end)}
+
+
+class MockArchiveServer:
+    """
+    Local stand-in for archive-api.open-meteo.com, serving <archive_response> JSON over HTTP on a background thread
+
+    Attributes:
+        latency: Seconds to wait before answering each request
+        error_rate: Share of requests, from 0 to 1, answered with <error_status> instead of data
+        error_status: HTTP status used for errors; 429 and 5xx are retried by <weather_fetch.ArchiveClient>
+        requests: Number of requests received
+        url: Archive endpoint URL to use as <WeatherData.api_url>, available once started
+
+    Methods:
+        start(self); stop(self):
+            start and stop serving; also used as a context manager
+    """
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, error_status: int = 503, seed: int = 0):
+        """
+        arguments:
+            latency, error_rate, error_status: as described in attributes
+            seed: Seed for choosing which requests fail
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/v1/archive'
+
+    def start(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body are written separately; without this, keep-alive connections wait on delayed ACKs
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                with mock._lock:
+                    mock.requests += 1
+                    failed = mock._random.random() < mock.error_rate
+                if mock.latency:
+                    time.sleep(mock.latency)
+
+                if failed:
+                    status, body = mock.error_status, {'error': True, 'reason': 'mock error'}
+                else:
+                    try:
+                        status, body = 200, archive_response(urlparse(self.path).query)
+                    except (KeyError, ValueError) as e:
+                        status, body = 400, {'error': True, 'reason': str(e)}
+
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,128 @@
+import queue
+import threading
+import time
+
+from sqlalchemy.orm import sessionmaker
+
+from database import upsert_weather_rows
+from metrics import default_metrics
+
+# Streaming store stage for main.ingest: fetched results are turned into rows and handed to a writer thread through a
+# bounded queue. The writer upserts and commits in batches while later fetches are still in flight, so network and
+# disk time overlap. When the queue is full the producer waits, and so does <weather_fetch.fetch_many>, so memory
+# stays flat however many venue-years a run covers.
+
+# Rows written per commit by the writer thread
+PIPELINE_BATCH_ROWS = 500
+
+# Lists of rows waiting for the writer before the producer has to wait
+PIPELINE_QUEUE_SIZE = 8
+
+# Put on the queue by <RowWriter.close> to stop the writer thread
+_DONE = object()
+
+
+class RowWriter:
+    """
+    Writer stage: a background thread taking lists of WeatherTable rows from a bounded queue and writing them with
+    <upsert_weather_rows>, committing every <batch_rows> rows in its own session
+
+    Attributes:
+        rows_written: Number of rows committed so far
+        commits: Number of commits so far
+        seconds: Time the writer thread has spent upserting and committing
+        error: Exception raised by the writer thread, or None
+
+    Methods:
+        start(self):
+            starts the writer thread; also used as a context manager
+        put(self, rows):
+            queues a list of rows, waiting while the queue is full; raises the writer's error if it failed
+        close(self):
+            commits the remaining rows, stops the thread, and returns <rows_written>; raises the writer's error if
+            it failed
+    """
+
+    def __init__(self, engine, batch_rows: int = PIPELINE_BATCH_ROWS, queue_size: int = PIPELINE_QUEUE_SIZE):
+        """
+        arguments:
+            engine: sqlalchemy engine, from <database.create_weather_engine>; a file database, as the writer
+            thread opens its own connection
+            batch_rows: Rows written per commit
+            queue_size: Lists of rows that can wait in the queue
+        """
+        self.engine = engine
+        self.batch_rows = batch_rows
+        self.rows_written = 0
+        self.commits = 0
+        self.seconds = 0.0
+        self.error = None
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='RowWriter', daemon=True)
+        self._thread.start()
+        return self
+
+    def put(self, rows: list):
+        """
+        :param rows: List of dictionaries of WeatherTable column: value
+        """
+        if self.error is not None:
+            raise self.error
+        if rows:
+            self._queue.put(rows)
+
+    def close(self):
+        """
+        :return: Number of rows committed
+        """
+        self._queue.put(_DONE)
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.rows_written
+
+    def _run(self):
+        session = sessionmaker(bind=self.engine)()
+        batch = []
+        try:
+            while True:
+                rows = self._queue.get()
+                if rows is _DONE:
+                    break
+                if self.error is not None:
+                    # Keep emptying the queue after a failure, so that the producer is never left waiting on it
+                    continue
+                batch.extend(rows)
+                if len(batch) >= self.batch_rows:
+                    self._commit(session, batch)
+                    batch = []
+            if self.error is None and batch:
+                self._commit(session, batch)
+        finally:
+            session.close()
+
+    def _commit(self, session, batch: list):
+        start = time.perf_counter()
+        try:
+            upsert_weather_rows(session, batch)
+            with default_metrics.timer('db.commit_seconds'):
+                session.commit()
+        except Exception as e:
+            session.rollback()
+            self.error = e
+        else:
+            self.rows_written += len(batch)
+            self.commits += 1
+        finally:
+            self.seconds += time.perf_counter() - start
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(_DONE)
+            self._thread.join()
@@ -0,0 +1,283 @@
+import csv
+import json
+import os
+import sqlite3
+from urllib.parse import quote
+
+from metrics import default_metrics
+from weather_grid import snap_to_grid
+from weather_sql import CLIMATOLOGY_COLUMNS, CLIMATOLOGY_STATISTICS, CLIMATOLOGY_VALUES, SUMMARY_COLUMNS
+
+# Only the standard library, metrics, weather_grid, and weather_sql are imported when this module loads, so that
+# read-only lookups start quickly; tabulate and pyarrow are imported by the functions that use them
+
+# Rows read from the cursor at a time when exporting
+EXPORT_CHUNK_SIZE = 5000
+
+# Most rows printed by query_table; larger results should be exported with <export_query>
+TABLE_MAX_ROWS = 1000
+
+# Columns of each row from <build_query>, as named in exported files
+EXPORT_COLUMNS = ['Latitude', 'Longitude', 'Month', 'Day', 'Year',
+                  'temp', 'average_temperature', 'max_temperature', 'min_temperature',
+                  'wind_speed', 'average_wind_speed', 'max_wind_speed', 'min_wind_speed',
+                  'precipitation', 'sum_precipitation', 'max_precipitation', 'min_precipitation']
+
+# File formats written by <export_query>, by file extension
+EXPORT_FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.parquet': 'parquet'}
+
+
+def connect_read_only(path: str):
+    """
+    Opens sqlite database read-only; raises sqlite3.OperationalError if it does not exist, instead of creating it
+    :param path: sqlite database file
+    :return: sqlite3 connection
+    """
+    return sqlite3.connect(f'file:{quote(os.path.abspath(path))}?mode=ro', uri=True)
+
+
+def build_query(lat: float = None, long: float = None, mon: int = None, da: int = None, years: list = None,
+                region: tuple = None, first_columns: str = 'ID, Month, Day, Year'):
+    """
+    Creates SQL statement selecting daily rows of Weather_Table joined with the aggregates of their location and date,
+    calculated over the same filtered rows, or read from the Weather_Summary view when every stored year is selected.
+    Every filter is optional; a location is matched by the archive grid cell it is in, as stored by main.py, see
+    <weather_grid.snap_to_grid>.
+    :param lat: Location Latitude; needs long
+    :param long: Location Longitude; needs lat
+    :param mon: Month
+    :param da: Day
+    :param years: Years to select and aggregate
+    :param region: (min_latitude, max_latitude, min_longitude, max_longitude) to select every location inside of
+    :param first_columns: Columns selected before the daily values and aggregates
+    :return: (query, params)
+    """
+    if lat is not None and long is not None:
+        lat, long = snap_to_grid(lat, long)
+    conditions, params = [], []
+    for column, value in (('Latitude', lat), ('Longitude', long), ('Month', mon), ('Day', da)):
+        if value is not None:
+            conditions.append(f'{column} = ?')
+            params.append(value)
+    if years is not None:
+        conditions.append(f'Year IN ({", ".join("?" for _ in years)})')
+        params += list(years)
+    if region is not None:
+        conditions.append('Latitude BETWEEN ? AND ? AND Longitude BETWEEN ? AND ?')
+        params += list(region)
+    where = ' AND '.join(conditions) or '1 = 1'
+
+    # Over every stored year the aggregates are those of the Weather_Summary view; the filters only select whole
+    # locations and dates, so they can be applied to the view. Other years are aggregated from the selected rows.
+    if years is None:
+        summary = f'SELECT * FROM Weather_Summary WHERE {where}'
+    else:
+        summary = (f'SELECT Latitude, Longitude, Month, Day, {SUMMARY_COLUMNS} FROM Weather_Table WHERE {where} '
+                   f'GROUP BY Latitude, Longitude, Month, Day')
+
+    query = (
+        f'WITH Summary AS ({summary}) '
+        f'SELECT {first_columns}, '
+        f'temp, average_temperature, max_temperature, min_temperature, '
+        f'wind_speed, average_wind_speed, max_wind_speed, min_wind_speed, '
+        f'precipitation, sum_precipitation, max_precipitation, min_precipitation '
+        f'FROM Weather_Table JOIN Summary USING (Latitude, Longitude, Month, Day) WHERE {where} '
+        f'ORDER BY Latitude, Longitude, Month, Day, Year;')
+    return query, params + params
+
+
+def query_table(lat: float, long: float, mon: int, da: int, years: list = None, path: str = 'weather_data.db',
+                max_rows: int = TABLE_MAX_ROWS):
+    """
+    Connects to sqlite database <path>. Creates table in terminal with headers using
+    SQL SELECT statement; each daily row is joined with the aggregates of the selected years, calculated from the
+    same rows, so that they always match what is stored
+    :param lat: Location Latitude
+    :param long: Location Longitude
+    :param mon: Month
+    :param da: Day, as 'day' was already in use
+    :param years: Years to show and aggregate; every stored year if None
+    :param path: sqlite database file written by main.py
+    :param max_rows: Most rows to print; use <export_query> for larger results
+    :return: SELECT * FROM Weather_Table JOIN (SELECT <SUMMARY_COLUMNS> FROM Weather_Table WHERE ...)
+    WHERE Latitude = lat AND Longitude = long AND Month = mon AND Day = da;
+    """
+    from tabulate import tabulate
+
+    # Connect to database, read-only
+    connection = connect_read_only(path)
+    try:
+        cursor = connection.cursor()
+
+        # Create SQL statement to form table from database
+        query, params = build_query(lat, long, mon, da, years)
+        with default_metrics.timer('query.seconds'):
+            cursor.execute(query, params)
+            full_weather = cursor.fetchmany(max_rows + 1)
+        cursor.close()
+    finally:
+        connection.close()
+    default_metrics.count('query.rows_read', len(full_weather))
+
+    # If database is successfully queried, create table in console with headers
+    if full_weather:
+        headers = ['ID', 'Month', 'Day', 'Year',
+                   'Daily_Temp (F)', 'Avg_Temp (F)', 'Max_Temp (F)', 'Min_Temp (F)',
+                   'Daily_Wind_Speed (mph)', 'Avg_Wind_Speed (mph)', 'Max_Wind_Speed (mph)', 'Min_Wind_Speed (mph)',
+                   'Daily_Precipitation (inches)', 'Sum_Precipitation (inches)',
+                   'Max_Precipitation (inches)', 'Min_Precipitation (inches)']
+
+        # Rows are selected in the order of the headers
+        table_data = [list(item) for item in full_weather[:max_rows]]
+
+        # Print table to console
+        print(tabulate(table_data, headers=headers, tablefmt='grid'))
+        if len(full_weather) > max_rows:
+            print(f'Only the first {max_rows} rows are shown; export the query to see every row.')
+    else:
+        print('Error')
+
+
+def read_climatology(lat: float, long: float, mon: int, da: int, path: str = 'weather_data.db'):
+    """
+    Looks up the precomputed day-of-year statistics of a location, from <climatology.build_climatology>, with one
+    search of the Climatology index
+    :param lat: Location Latitude, matched by archive grid cell
+    :param long: Location Longitude, matched by archive grid cell
+    :param mon: Month
+    :param da: Day
+    :param path: sqlite database file written by main.py
+    :return: Dictionary with First_Year, Last_Year, Years, and each of <CLIMATOLOGY_COLUMNS>, or None if the location
+    and day are not summarised
+    """
+    lat, long = snap_to_grid(lat, long)
+    connection = connect_read_only(path)
+    try:
+        row = connection.execute(
+            f'SELECT First_Year, Last_Year, Years, {", ".join(CLIMATOLOGY_COLUMNS)} FROM Climatology '
+            f'WHERE Latitude = ? AND Longitude = ? AND Month = ? AND Day = ?;', (lat, long, mon, da)).fetchone()
+    finally:
+        connection.close()
+    if row is None:
+        return None
+    return dict(zip(['First_Year', 'Last_Year', 'Years', *CLIMATOLOGY_COLUMNS], row))
+
+
+def query_climatology(lat: float, long: float, mon: int, da: int, path: str = 'weather_data.db'):
+    """
+    Creates table in terminal of the statistics from <read_climatology>, one row per daily value
+    :param lat: Location Latitude
+    :param long: Location Longitude
+    :param mon: Month
+    :param da: Day
+    :param path: sqlite database file written by main.py
+    """
+    from tabulate import tabulate
+
+    climatology = read_climatology(lat, long, mon, da, path)
+    if climatology is None:
+        print('Error: no climatology stored for this location; gather it with --climatology')
+        return
+
+    names = {'temp': 'Temp (F)', 'wind_speed': 'Wind_Speed (mph)', 'precipitation': 'Precipitation (inches)'}
+    table_data = [[names[value], *(climatology[f'{value}_{statistic}'] for statistic in CLIMATOLOGY_STATISTICS)]
+                  for value in CLIMATOLOGY_VALUES]
+    print(f'Day-of-year statistics over {climatology["Years"]} years, '
+          f'{climatology["First_Year"]}-{climatology["Last_Year"]}:')
+    print(tabulate(table_data, headers=['', *CLIMATOLOGY_STATISTICS], tablefmt='grid'))
+
+
+def iter_query_chunks(cursor, query: str, params: list, chunk_size: int = EXPORT_CHUNK_SIZE):
+    """
+    Runs query and reads its rows <chunk_size> at a time, so that only one chunk is held in memory
+    :return: Generator of lists of row tuples
+    """
+    cursor.execute(query, params)
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield rows
+
+
+def export_query(output: str, file_format: str = None, lat: float = None, long: float = None, mon: int = None,
+                 da: int = None, years: list = None, region: tuple = None, path: str = 'weather_data.db',
+                 chunk_size: int = EXPORT_CHUNK_SIZE, selections: list = None):
+    """
+    Streams the rows selected by <build_query> into a file as they are read, <chunk_size> rows at a time, so that
+    memory does not grow with the number of rows. Parquet files need the optional 'pyarrow' library.
+    :param output: File to write
+    :param file_format: 'csv', 'jsonl', or 'parquet'; taken from the extension of output if None
+    :param lat, long, mon, da, years, region: Filters passed to <build_query>
+    :param path: sqlite database file written by main.py
+    :param chunk_size: Rows read and written at a time
+    :param selections: List of dictionaries of <build_query> filters, exported one after another into the same file;
+    used instead of the filter arguments
+    :return: Number of rows written
+    """
+    if file_format is None:
+        extension = output[output.rfind('.'):].lower() if '.' in output else ''
+        file_format = EXPORT_FORMATS.get(extension)
+    if file_format not in EXPORT_FORMATS.values():
+        raise ValueError(f'Unknown export format for {output}: choose one of {", ".join(EXPORT_FORMATS.values())}')
+
+    if selections is None:
+        selections = [dict(lat=lat, long=long, mon=mon, da=da, years=years, region=region)]
+
+    connection = connect_read_only(path)
+    try:
+        cursor = connection.cursor()
+        chunks = (rows for selection in selections
+                  for rows in iter_query_chunks(cursor, *build_query(
+                      **selection, first_columns='Latitude, Longitude, Month, Day, Year'), chunk_size))
+        with default_metrics.timer('query.seconds'):
+            if file_format == 'csv':
+                count = _write_csv(output, chunks)
+            elif file_format == 'jsonl':
+                count = _write_jsonl(output, chunks)
+            else:
+                count = _write_parquet(output, chunks)
+        default_metrics.count('query.rows_read', count)
+        return count
+    finally:
+        connection.close()
+
+
+def _write_csv(output: str, chunks):
+    count = 0
+    with open(output, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(EXPORT_COLUMNS)
+        for rows in chunks:
+            writer.writerows(rows)
+            count += len(rows)
+    return count
+
+
+def _write_jsonl(output: str, chunks):
+    count = 0
+    with open(output, 'w') as file:
+        for rows in chunks:
+            file.writelines(json.dumps(dict(zip(EXPORT_COLUMNS, row))) + '\n' for row in rows)
+            count += len(rows)
+    return count
+
+
+def _write_parquet(output: str, chunks):
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Exporting to parquet needs the 'pyarrow' library: pip install pyarrow") from None
+
+    integer_columns = {'Month', 'Day', 'Year'}
+    schema = pyarrow.schema([(column, pyarrow.int32() if column in integer_columns else pyarrow.float64())
+                             for column in EXPORT_COLUMNS])
+    count = 0
+    with pyarrow.parquet.ParquetWriter(output, schema) as writer:
+        for rows in chunks:
+            columns = list(zip(*rows))
+            writer.write_table(pyarrow.Table.from_arrays(
+                [pyarrow.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema))
+            count += len(rows)
+    return count
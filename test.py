@@ -1,5 +1,36 @@
+import asyncio
+import csv
+import datetime
+import json
+import os
+import pstats
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
 import unittest
-from weather_data import WeatherData
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from urllib.parse import urlparse
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from analytics import event_dates, rank_locations
+from climatology import build_climatology, fetch_daily_series
+from database import WeatherTable, create_weather_engine, init_db, stored_years, upsert_weather_row, \
+    upsert_weather_rows
+from main import ingest, load_venues
+from metrics import Metrics, default_metrics, profile
+from mock_archive import MockArchiveServer, archive_response
+from pipeline import RowWriter
+from query import EXPORT_COLUMNS, build_query, connect_read_only, export_query, query_table, read_climatology
+from weather_cache import ResponseCache
+from weather_data import AsyncWeatherData, WeatherData, WeatherSeries, aggregate_values, newest_archive_date
+from weather_fetch import ArchiveClient, FetchJob, fetch_many
+from weather_grid import ARCHIVE_MODEL, GRID_PARAMETERS, snap_to_grid
+from weather_sql import CLIMATOLOGY_STATISTICS
 
 # Latitude and longitude are set to New Orleans, Louisiana
 latitude, longitude = 29.9547, -90.0751
@@ -8,10 +39,14 @@ month, day = 10, 31
 # Years are last 5 years, from 2025
 years = [2020, 2021, 2022, 2023, 2024]
 
+# Tests run against <MockArchiveServer> unless WEATHER_API_LIVE=1 is set, to test against the real archive API
+live_api = os.environ.get('WEATHER_API_LIVE') == '1'
+
 
 class TestWeatherData(unittest.TestCase):
     """
-    setUpClass to instance WeatherData class as an object;
+    setUpClass to instance WeatherData class as an object, gathering data from the real API if <live_api>, or else
+    from a local <MockArchiveServer>;
 
     test_1: Ensure that weather_info variable from WeatherClass instance is not none;
             Ensure that there are 5 items in WeatherClass instance for the 5 years;
@@ -25,7 +60,12 @@ class TestWeatherData(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         cls.weather_data = WeatherData(latitude=latitude, longitude=longitude, month=month, day=day, years=years)
-        cls.weather_data.call_weather_api()
+        if live_api:
+            cls.weather_data.call_weather_api()
+        else:
+            with MockArchiveServer() as server:
+                cls.weather_data.api_url = server.url
+                cls.weather_data.call_weather_api()
         print('Setup completed\n')
 
     # Check if weather_info list is populated. Should have 5 items, and should not be None
@@ -60,5 +100,807 @@ class TestWeatherData(unittest.TestCase):
         print('Third test passed!\n')
 
 
+class FakeArchiveResponse:
+    """
+    Stand-in for <requests.Response> returned by <fake_archive_get>, with data from <mock_archive.archive_response>
+    """
+    def __init__(self, url: str):
+        self.status_code = 200
+        self._data = archive_response(urlparse(url).query)
+
+    def json(self):
+        return self._data
+
+
+def fake_archive_get(url: str, **kwargs):
+    return FakeArchiveResponse(url)
+
+
+class TestBatchedWeatherApi(unittest.TestCase):
+    """
+    test_batch_matches_per_year: batch mode returns the same <weather_info> as one request per year
+    test_batch_request_count: batch mode makes one request per chunk of years instead of one per year
+    test_batch_leap_day: years without February 29 are skipped, as in the per-year loop
+    test_batch_ends_in_archive: chunks end on the date of their last year, and a year the archive does not have yet,
+    answered with 400, does not fail the other years
+    """
+    def run_api(self, years: list, month: int = 10, day: int = 31, **kwargs):
+        weather = WeatherData(latitude, longitude, month, day, years)
+        with mock.patch('weather_data.requests.get', side_effect=fake_archive_get) as get:
+            weather.call_weather_api(**kwargs)
+        return weather, get
+
+    def test_batch_matches_per_year(self):
+        years_list = [2024, 1990, 2001, 2002, 2015]
+        per_year, _ = self.run_api(years_list)
+        batched, _ = self.run_api(years_list, batch=True)
+        self.assertEqual(per_year.weather_info, batched.weather_info)
+
+    def test_batch_request_count(self):
+        _, get = self.run_api(list(range(1995, 2025)), batch=True, chunk_years=10)
+        self.assertEqual(get.call_count, 3)
+
+    def test_batch_leap_day(self):
+        weather, _ = self.run_api([2019, 2020, 2024], month=2, day=29, batch=True)
+        self.assertEqual([item['year'] for item in weather.weather_info], [2020, 2024])
+
+    def test_batch_ends_in_archive(self):
+        newest = newest_archive_date()
+        recent = list(range(newest.year - 9, newest.year + 1))
+        with MockArchiveServer() as server:
+            weather = WeatherData(latitude, longitude, newest.month, 1, recent + [newest.year + 1])
+            weather.api_url = server.url
+            weather.call_weather_api(batch=True)
+            self.assertEqual(server.requests, 2)
+        self.assertEqual([item['year'] for item in weather.weather_info], recent)
+
+
+class FlakyArchiveSession:
+    """
+    Session stand-in for <ArchiveClient> answering 429 to the first <failures> requests, then archive data
+    """
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.calls = 0
+
+    def get(self, url: str, **kwargs):
+        self.calls += 1
+        if self.calls <= self.failures:
+            return mock.Mock(status_code=429, headers={})
+        return FakeArchiveResponse(url)
+
+
+class TestFetchMany(unittest.TestCase):
+    """
+    test_all_jobs_returned: every job yields one FetchResult with the same data as a direct call_weather_api
+    test_retry_on_429: ArchiveClient retries rate-limited responses
+    """
+    def test_all_jobs_returned(self):
+        client = ArchiveClient(requests_per_second=0, session_factory=FlakyArchiveSession)
+        jobs = [(29.95 + n, -90.07, 10, 31, years) for n in range(6)]
+        results = list(fetch_many(jobs, workers=3, client=client))
+
+        self.assertEqual(len(results), 6)
+        for result in results:
+            self.assertIsNone(result.error)
+            self.assertIsInstance(result.job, FetchJob)
+            expected = WeatherData(*result.job)
+            with mock.patch('weather_data.requests.get', side_effect=fake_archive_get):
+                expected.call_weather_api()
+            self.assertEqual(result.weather.weather_info, expected.weather_info)
+
+    def test_retry_on_429(self):
+        client = ArchiveClient(requests_per_second=0, backoff=0, session_factory=lambda: FlakyArchiveSession(2))
+        response = client.get(WeatherData(latitude, longitude, month, day, years).archive_url('2024-10-31',
+                                                                                              '2024-10-31'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(client.session.calls, 3)
+
+
+class FakeAsyncClient:
+    """
+    Stand-in for <httpx.AsyncClient> answering with <FakeArchiveResponse>
+    """
+    def __init__(self):
+        self.calls = 0
+
+    async def get(self, url: str, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(0)
+        return FakeArchiveResponse(url)
+
+
+class TestAsyncWeatherData(unittest.TestCase):
+    """
+    test_matches_sync: acall_weather_api returns the same <weather_info> as call_weather_api, in both modes
+    """
+    def test_matches_sync(self):
+        for batch in (False, True):
+            expected = WeatherData(latitude, longitude, month, day, years)
+            with mock.patch('weather_data.requests.get', side_effect=fake_archive_get):
+                expected.call_weather_api(batch=batch)
+
+            weather = AsyncWeatherData(latitude, longitude, month, day, years)
+            client = FakeAsyncClient()
+            asyncio.run(weather.acall_weather_api(batch=batch, client=client))
+            self.assertEqual(weather.weather_info, expected.weather_info)
+            self.assertEqual(client.calls, 1 if batch else len(years))
+
+
+class TestResponseCache(unittest.TestCase):
+    """
+    test_repeat_lookup_skips_network: a second lookup is answered from the cache with the same <weather_info>
+    test_eviction: entries over <max_entries> are evicted, oldest first
+    test_endpoint_in_key: values cached from one endpoint are not served for another
+    """
+    def test_repeat_lookup_skips_network(self):
+        cache = ResponseCache(':memory:')
+        first = WeatherData(latitude, longitude, month, day, years, cache=cache)
+        second = WeatherData(latitude, longitude, month, day, years, cache=cache)
+        with mock.patch('weather_data.requests.get', side_effect=fake_archive_get) as get:
+            first.call_weather_api(batch=True)
+            second.call_weather_api(batch=True)
+
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(first.weather_info, second.weather_info)
+        self.assertEqual(cache.stats(), {'hits': 5, 'misses': 5, 'entries': 5})
+
+    def test_eviction(self):
+        cache = ResponseCache(':memory:', max_entries=3)
+        weather = WeatherData(latitude, longitude, month, day, years, cache=cache)
+        with mock.patch('weather_data.requests.get', side_effect=fake_archive_get):
+            weather.call_weather_api()
+        self.assertEqual(cache.stats()['entries'], 3)
+
+    def test_endpoint_in_key(self):
+        cache = ResponseCache(':memory:')
+        mocked = WeatherData(latitude, longitude, month, day, years, cache=cache)
+        mocked.api_url = 'http://127.0.0.1:8000/v1/archive'
+        real = WeatherData(latitude, longitude, month, day, years, cache=cache)
+        with mock.patch('weather_data.requests.get', side_effect=fake_archive_get) as get:
+            mocked.call_weather_api(batch=True)
+            real.call_weather_api(batch=True)
+        self.assertEqual(get.call_count, 2)
+        self.assertEqual(cache.stats(), {'hits': 0, 'misses': 10, 'entries': 10})
+
+
+class TestIncrementalStorage(unittest.TestCase):
+    """
+    test_upsert_keeps_history: upserting a stored year replaces its daily values instead of adding a second row,
+    and stored_years returns only the years already in the table
+    test_summary_view: Weather_Summary aggregates the stored daily rows of each location and date
+    test_query_reads_summary_view: build_query reads Weather_Summary over every stored year, with the same results as
+    aggregating the selected years
+    test_legacy_migration: a Weather_Table with aggregate columns on every row is rebuilt with only daily values
+    test_snap_migration: rows stored at unsnapped locations are moved onto their grid cell, keeping the newest row
+    """
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+
+    def test_upsert_keeps_history(self):
+        init_db(self.engine)
+        session = sessionmaker(bind=self.engine)()
+
+        for year, temp in ((2023, 60.0), (2024, 60.0), (2024, 70.0)):
+            upsert_weather_row(session, dict(Latitude=latitude, Longitude=longitude, Month=month, Day=day, Year=year,
+                                             temp=temp, wind_speed=5.0, precipitation=0.1))
+        session.commit()
+
+        self.assertEqual(session.query(WeatherTable).count(), 2)
+        self.assertEqual(session.query(WeatherTable).filter_by(Year=2024).one().temp, 70.0)
+        self.assertEqual(sorted(stored_years(session, latitude, longitude, month, day, years)), [2023, 2024])
+
+    def test_summary_view(self):
+        init_db(self.engine)
+        session = sessionmaker(bind=self.engine)()
+        upsert_weather_rows(session, [dict(Latitude=latitude, Longitude=longitude, Month=month, Day=day, Year=year,
+                                           temp=float(year - 2000), wind_speed=5.0, precipitation=0.5)
+                                      for year in years])
+        session.commit()
+
+        summary = session.connection().exec_driver_sql(
+            'SELECT Years, average_temperature, max_temperature, sum_precipitation FROM Weather_Summary;').one()
+        self.assertEqual(tuple(summary), (5, 22.0, 24.0, 2.5))
+
+    def test_query_reads_summary_view(self):
+        init_db(self.engine)
+        session = sessionmaker(bind=self.engine)()
+        lat, long = snap_to_grid(latitude, longitude)
+        upsert_weather_rows(session, [dict(Latitude=lat, Longitude=long, Month=month, Day=day, Year=year,
+                                           temp=float(year - 2000), wind_speed=5.0, precipitation=0.5)
+                                      for year in years])
+        session.commit()
+
+        query, params = build_query(latitude, longitude, month, day)
+        self.assertIn('Weather_Summary', query)
+        every_year = session.connection().exec_driver_sql(query, tuple(params)).all()
+        query, params = build_query(latitude, longitude, month, day, years)
+        self.assertNotIn('Weather_Summary', query)
+        self.assertEqual(every_year, session.connection().exec_driver_sql(query, tuple(params)).all())
+        self.assertEqual(len(every_year), 5)
+
+    def test_legacy_migration(self):
+        with self.engine.begin() as connection:
+            connection.exec_driver_sql(
+                'CREATE TABLE Weather_Table (ID INTEGER PRIMARY KEY, Longitude FLOAT, Latitude FLOAT, Month INTEGER, '
+                'Day INTEGER, Year INTEGER, temp FLOAT, average_temperature FLOAT, wind_speed FLOAT, '
+                'precipitation FLOAT, sum_precipitation FLOAT);')
+            for year in (2023, 2024, 2024):
+                connection.exec_driver_sql(
+                    'INSERT INTO Weather_Table (Longitude, Latitude, Month, Day, Year, temp, average_temperature, '
+                    'wind_speed, precipitation, sum_precipitation) VALUES (?, ?, ?, ?, ?, 60, 60, 5, 0.1, 0.2);',
+                    (longitude, latitude, month, day, year))
+        init_db(self.engine)
+
+        with self.engine.connect() as connection:
+            columns = [row[1] for row in connection.exec_driver_sql('PRAGMA table_info(Weather_Table);')]
+            count = connection.exec_driver_sql('SELECT COUNT(*) FROM Weather_Table;').scalar()
+        self.assertNotIn('average_temperature', columns)
+        self.assertEqual(count, 2)
+
+    def test_snap_migration(self):
+        init_db(self.engine)
+        session = sessionmaker(bind=self.engine)()
+        upsert_weather_rows(session, [dict(Latitude=latitude + offset, Longitude=longitude, Month=month, Day=day,
+                                           Year=year, temp=temp, wind_speed=5.0, precipitation=0.1)
+                                      for offset, year, temp in ((0, 2023, 60.0), (0, 2024, 61.0), (0.01, 2024, 62.0))])
+        session.commit()
+        session.close()
+        init_db(self.engine)
+
+        with self.engine.connect() as connection:
+            rows = connection.exec_driver_sql('SELECT Latitude, Longitude, Year, temp FROM Weather_Table '
+                                              'ORDER BY Year;').all()
+        self.assertEqual([tuple(row) for row in rows], [(*snap_to_grid(latitude, longitude), 2023, 60.0),
+                                                        (*snap_to_grid(latitude, longitude), 2024, 62.0)])
+
+
+class TestBulkStorage(unittest.TestCase):
+    """
+    test_bulk_upsert: many rows are written by one upsert call, on a WAL-mode database
+    test_query_uses_index: the query_table predicate is answered through an index, not a table scan
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.path = os.path.join(cls.directory.name, 'weather_data.db')
+        cls.engine = create_weather_engine(cls.path)
+        init_db(cls.engine)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.engine.dispose()
+        cls.directory.cleanup()
+
+    def test_bulk_upsert(self):
+        rows = [dict(Latitude=latitude + n / 100, Longitude=longitude, Month=month, Day=day, Year=year,
+                     temp=65.0, wind_speed=5.0, precipitation=0.1)
+                for n in range(50) for year in range(1980, 2020)]
+        session = sessionmaker(bind=self.engine)()
+        upsert_weather_rows(session, rows)
+        upsert_weather_rows(session, rows[:10])
+        session.commit()
+
+        self.assertEqual(session.query(WeatherTable).count(), 2000)
+        with self.engine.connect() as connection:
+            self.assertEqual(connection.exec_driver_sql('PRAGMA journal_mode;').scalar(), 'wal')
+        session.close()
+
+    def test_query_uses_index(self):
+        connection = sqlite3.connect(self.path)
+        plan = connection.execute('EXPLAIN QUERY PLAN SELECT * FROM Weather_Table WHERE Latitude = ? AND '
+                                  'Longitude = ? AND Month = ? AND Day = ? ORDER BY Year;',
+                                  (latitude, longitude, month, day)).fetchall()
+        connection.close()
+        self.assertIn('USING INDEX', ' '.join(row[-1] for row in plan))
+
+
+class TestAggregate(unittest.TestCase):
+    """
+    test_aggregate_values: one-pass statistics match the statistics module
+    test_memoized_until_changed: aggregate is reused until weather_info changes, and get_<weather_param> agrees
+    """
+    def test_aggregate_values(self):
+        values = [55.3, 59.6, 63.1, 65.6, 76.7, 70.2]
+        result = aggregate_values(values)
+        self.assertAlmostEqual(result['avg'], statistics.mean(values))
+        self.assertAlmostEqual(result['std'], statistics.stdev(values))
+        self.assertAlmostEqual(result['p50'], statistics.median(values))
+        self.assertEqual((result['min'], result['max'], result['count']), (55.3, 76.7, 6))
+        self.assertIsNone(aggregate_values([])['avg'])
+
+    def test_memoized_until_changed(self):
+        weather = WeatherData(latitude, longitude, month, day, years)
+        with mock.patch('weather_data.requests.get', side_effect=fake_archive_get):
+            weather.call_weather_api(batch=True)
+
+        first = weather.aggregate()
+        self.assertIs(weather.aggregate(), first)
+        temps = weather.create_weather_list('mean_temperature')
+        self.assertAlmostEqual(weather.get_temp('avg'), sum(temps) / len(temps))
+        self.assertEqual(weather.get_precipitation('sum'), sum(weather.create_weather_list('sum_precipitation')))
+
+        weather.weather_info.append({'year': 2025, 'mean_temperature': 200.0, 'max_wind_speed': 1.0,
+                                     'sum_precipitation': 0.0})
+        self.assertIsNot(weather.aggregate(), first)
+        self.assertEqual(weather.get_temp('max'), 200.0)
+
+
+class TestWeatherSeries(unittest.TestCase):
+    """
+    test_list_compatibility: WeatherSeries reads, compares, and updates as the list of dictionaries it replaces,
+    keeping None values
+    test_slice_assignment: slices are replaced as in a list, and to_list gives a list to serialize
+    test_assignment_invalidates: assigning to weather_info items is detected by aggregate, and create_weather_list
+    still returns every year, including for 'year'
+    test_weather_info_is_list: weather_info and the result of call_weather_api are lists that serialize, and edits to
+    weather_info dictionaries reach the aggregates
+    """
+    records = [{'year': 2023, 'mean_temperature': 61.5, 'max_wind_speed': None, 'sum_precipitation': 0.2},
+               {'year': 2024, 'mean_temperature': 70.0, 'max_wind_speed': 9.0, 'sum_precipitation': 0.0}]
+
+    def test_list_compatibility(self):
+        series = WeatherSeries(self.records)
+        self.assertEqual(series, self.records)
+        self.assertEqual((len(series), series[-1], series[:1]), (2, self.records[1], self.records[:1]))
+        self.assertEqual(list(series.years), [2023, 2024])
+        self.assertEqual(list(series.column('max_wind_speed')), [9.0])
+        with self.assertRaises(IndexError):
+            series[2]
+
+    def test_slice_assignment(self):
+        series = WeatherSeries(self.records)
+        version = series.version
+        series[:1] = [dict(self.records[0], year=2021), dict(self.records[0], year=2022)]
+        self.assertEqual([record['year'] for record in series], [2021, 2022, 2024])
+        self.assertGreater(series.version, version)
+        before = series[:]
+        series[1:] = []
+        self.assertEqual(series, before[:1])
+        self.assertEqual(json.loads(json.dumps(series.to_list())), before[:1])
+
+    def test_assignment_invalidates(self):
+        weather = WeatherData(latitude, longitude, month, day, [2023, 2024])
+        weather.weather_info = self.records
+        self.assertIsInstance(weather.weather_series, WeatherSeries)
+        self.assertEqual(weather.get_wind_speed('count'), 1)
+        self.assertEqual(weather.create_weather_list('max_wind_speed'), [None, 9.0])
+        self.assertEqual(weather.create_weather_list('year'), [2023, 2024])
+
+        weather.weather_info[0] = dict(self.records[0], mean_temperature=80.0)
+        self.assertEqual(weather.get_temp('max'), 80.0)
+
+    def test_weather_info_is_list(self):
+        weather = WeatherData(latitude, longitude, month, day, years)
+        with mock.patch('weather_data.requests.get', side_effect=fake_archive_get):
+            gathered = weather.call_weather_api()
+
+        self.assertEqual(json.loads(json.dumps(gathered)), gathered)
+        self.assertIsInstance(weather.weather_info, list)
+        self.assertIs(weather.weather_info, weather.weather_info)
+        self.assertEqual(weather.weather_info, gathered)
+
+        weather.weather_info[0]['mean_temperature'] = 200.0
+        self.assertEqual(weather.get_temp('max'), 200.0)
+        self.assertEqual(weather.weather_series[0]['mean_temperature'], 200.0)
+
+        info = weather.weather_info
+        weather.weather_series.append(dict(gathered[0], year=2025))
+        self.assertIs(weather.weather_info, info)
+        self.assertEqual(info[-1]['year'], 2025)
+
+
+class TestWeatherWindow(unittest.TestCase):
+    """
+    test_window_one_request_per_year: a +/-7 day window of a 3 day event is gathered with one request per year,
+    with per-day lists and the event day in weather_info
+    test_window_aggregate: window aggregates cover every day of every window
+    """
+    def setUp(self):
+        self.weather = WeatherData(latitude, longitude, month, day, years, days=3, window=7)
+        with mock.patch('weather_data.requests.get', side_effect=fake_archive_get) as get:
+            self.weather.call_weather_window()
+        self.get = get
+
+    def test_window_one_request_per_year(self):
+        self.assertEqual(self.get.call_count, len(years))
+        first = self.weather.window_info[0]
+        self.assertEqual(len(first['dates']), 17)
+        self.assertEqual((first['dates'][0], first['dates'][-1]), ('2020-10-24', '2020-11-09'))
+        self.assertEqual(len(first['mean_temperature']), 17)
+
+        expected = WeatherData(latitude, longitude, month, day, years)
+        with mock.patch('weather_data.requests.get', side_effect=fake_archive_get):
+            expected.call_weather_api()
+        self.assertEqual(self.weather.weather_info, expected.weather_info)
+
+    def test_window_aggregate(self):
+        pooled = [value for info in self.weather.window_info for value in info['sum_precipitation']]
+        result = self.weather.window_aggregate()['sum_precipitation']
+        self.assertEqual(result['count'], 17 * len(years))
+        self.assertAlmostEqual(result['sum'], sum(pooled))
+        self.assertEqual(self.weather.window_aggregate(2024)['mean_temperature']['count'], 17)
+
+
+class TestMockArchiveServer(unittest.TestCase):
+    """
+    test_errors_are_retried: fetch_many against a server failing a third of requests still gathers every year,
+    through ArchiveClient retries
+    """
+    def test_errors_are_retried(self):
+        jobs = [(latitude + n / 10, longitude, month, day, years) for n in range(4)]
+        with MockArchiveServer(error_rate=0.3, seed=1) as server:
+            client = ArchiveClient(requests_per_second=0, backoff=0.01, max_retries=8)
+            results = list(fetch_many(jobs, workers=2, batch=False, client=client, api_url=server.url))
+            requests_received = server.requests
+
+        self.assertGreater(requests_received, len(jobs) * len(years))
+        for result in results:
+            self.assertEqual([item['year'] for item in result.weather.weather_info], years)
+
+
+class TestBatchCli(unittest.TestCase):
+    """
+    test_load_venues: CSV and JSON venue files give the same jobs, with every way of writing years
+    test_ingest_skips_stored: a second ingest of the same venues writes nothing and sends no requests
+    test_nearby_venues_share_cell: venues in one archive grid cell are gathered and stored once, and found by query
+    test_requests_name_grid_model: requests and cache keys name the model whose grid coordinates are snapped to, and
+    ask for the nearest cell
+    """
+    def write(self, directory: str, name: str, text: str):
+        path = os.path.join(directory, name)
+        with open(path, 'w') as file:
+            file.write(text)
+        return path
+
+    def test_load_venues(self):
+        with tempfile.TemporaryDirectory() as directory:
+            csv_jobs = load_venues(self.write(directory, 'venues.csv',
+                                              'latitude,longitude,month,day,years,num_years,last_year\n'
+                                              '29.9547,-90.0751,10,31,2020-2024,,\n'
+                                              '30.1,-91.0,7,4,2019;2021,,\n'
+                                              '30.2,-91.0,7,4,,3,2024\n'))
+            json_jobs = load_venues(self.write(directory, 'venues.json', json.dumps([
+                {'latitude': 29.9547, 'longitude': -90.0751, 'month': 10, 'day': 31, 'years': years},
+                {'latitude': 30.1, 'longitude': -91.0, 'month': 7, 'day': 4, 'years': '2019 2021'},
+                {'latitude': 30.2, 'longitude': -91.0, 'month': 7, 'day': 4, 'num_years': 3, 'last_year': 2024},
+            ])))
+        self.assertEqual(csv_jobs, json_jobs)
+        self.assertEqual(csv_jobs[0], FetchJob(latitude, longitude, month, day, years))
+        self.assertEqual(csv_jobs[2].years, [2022, 2023, 2024])
+
+    def test_ingest_skips_stored(self):
+        engine = create_engine('sqlite://')
+        init_db(engine)
+        jobs = [FetchJob(latitude + n / 10, longitude, month, day, years) for n in range(3)]
+        with MockArchiveServer() as server, mock.patch.object(WeatherData, 'api_url', server.url):
+            client = ArchiveClient(requests_per_second=0)
+            self.assertEqual(ingest(engine, jobs, client=client), 15)
+            sent = server.requests
+            self.assertEqual(ingest(engine, jobs, client=client), 0)
+            self.assertEqual(server.requests, sent)
+
+    def test_nearby_venues_share_cell(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'weather_data.db')
+            engine = create_weather_engine(path)
+            init_db(engine)
+            jobs = [FetchJob(latitude + n / 1000, longitude - n / 1000, month, day, years) for n in range(4)]
+            with MockArchiveServer() as server, mock.patch.object(WeatherData, 'api_url', server.url):
+                results = list(fetch_many(jobs, client=ArchiveClient(requests_per_second=0)))
+                self.assertEqual(server.requests, 1)
+                self.assertEqual(sorted(result.job for result in results), sorted(jobs))
+                self.assertEqual(ingest(engine, jobs, client=ArchiveClient(requests_per_second=0)), 5)
+            engine.dispose()
+
+            connection = sqlite3.connect(path)
+            self.assertEqual(connection.execute('SELECT DISTINCT Latitude, Longitude FROM Weather_Table;').fetchall(),
+                             [snap_to_grid(latitude, longitude)])
+            query, params = build_query(latitude + 0.003, longitude + 0.001, month, day, years)
+            self.assertEqual(len(connection.execute(query, params).fetchall()), 5)
+            connection.close()
+
+    def test_requests_name_grid_model(self):
+        weather = WeatherData(latitude, longitude, month, day, years)
+        url = weather.archive_url('2024-10-31', '2024-10-31')
+        self.assertIn(f'models={ARCHIVE_MODEL}&', url)
+        self.assertIn('cell_selection=nearest&', url)
+        self.assertIn(GRID_PARAMETERS, weather.cache_key()[-1])
+
+
+class TestPipeline(unittest.TestCase):
+    """
+    test_writer_batches: RowWriter commits every batch_rows rows through a bounded queue, and the rest when closed
+    test_matches_one_transaction: a pipelined ingest stores the same rows as storing everything at the end
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def engine(self, name: str):
+        engine = create_weather_engine(os.path.join(self.directory.name, name))
+        init_db(engine)
+        self.addCleanup(engine.dispose)
+        return engine
+
+    def test_writer_batches(self):
+        engine = self.engine('writer.db')
+        with RowWriter(engine, batch_rows=4, queue_size=1) as writer:
+            for year in years:
+                writer.put([dict(Latitude=latitude + n, Longitude=longitude, Month=month, Day=day, Year=year,
+                                 temp=60.0, wind_speed=5.0, precipitation=0.1) for n in range(2)])
+            self.assertEqual(writer.close(), 10)
+        self.assertEqual(writer.commits, 3)
+        self.assertGreater(writer.seconds, 0)
+        with engine.connect() as connection:
+            self.assertEqual(connection.exec_driver_sql('SELECT COUNT(*) FROM Weather_Table;').scalar(), 10)
+
+    def test_matches_one_transaction(self):
+        jobs = [FetchJob(latitude + n / 10, longitude, month, day, years) for n in range(6)]
+        stored = []
+        with MockArchiveServer() as server, mock.patch.object(WeatherData, 'api_url', server.url):
+            for pipeline in (False, True):
+                engine = self.engine(f'pipeline_{pipeline}.db')
+                self.assertEqual(ingest(engine, jobs, client=ArchiveClient(requests_per_second=0), workers=2,
+                                        pipeline=pipeline), 30)
+                with engine.connect() as connection:
+                    stored.append(connection.exec_driver_sql(
+                        'SELECT Latitude, Longitude, Month, Day, Year, temp, wind_speed, precipitation '
+                        'FROM Weather_Table ORDER BY Latitude, Year;').all())
+        self.assertEqual(stored[0], stored[1])
+
+
+class TestMetrics(unittest.TestCase):
+    """
+    test_histogram_and_hooks: durations are bucketed with exact count and extremes, and hooks see every value
+    test_run_records_hot_paths: a run records requests, retries, bytes, rows written, and query time
+    test_latency_excludes_throttling: request latency is timed per attempt, apart from rate limiter waits
+    test_profile_sees_threads: functions run by threads started inside profile are in its statistics
+    """
+    def test_histogram_and_hooks(self):
+        metrics = Metrics()
+        seen = []
+        metrics.add_hook(lambda kind, name, value: seen.append((kind, name)))
+        for seconds in (0.002, 0.004, 0.040, 3.0):
+            metrics.observe('latency', seconds)
+        metrics.count('errors')
+
+        summary = json.loads(json.dumps(metrics.summary()))['histograms']['latency']
+        self.assertEqual((summary['count'], summary['min_ms'], summary['max_ms']), (4, 2.0, 3000.0))
+        self.assertEqual(summary['buckets'], {'<=2.5': 1, '<=5': 1, '<=50': 1, '<=5000': 1})
+        self.assertEqual(summary['p50_ms'], 5)
+        self.assertEqual(seen, [('observe', 'latency')] * 4 + [('count', 'errors')])
+
+    def test_run_records_hot_paths(self):
+        default_metrics.reset()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'weather_data.db')
+            engine = create_weather_engine(path)
+            init_db(engine)
+            jobs = [FetchJob(latitude + n / 10, longitude, month, day, years) for n in range(3)]
+            with MockArchiveServer(error_rate=0.3, seed=2) as server, \
+                    mock.patch.object(WeatherData, 'api_url', server.url):
+                client = ArchiveClient(requests_per_second=0, backoff=0.01, max_retries=8)
+                ingest(engine, jobs, client=client)
+            engine.dispose()
+            query_table(latitude, longitude, month, day, years, path=path)
+
+        summary = default_metrics.summary()
+        counters = summary['counters']
+        self.assertEqual(counters['http.requests'], 3)
+        self.assertGreater(server.requests, 3)
+        self.assertEqual(counters['http.retries'], server.requests - 3)
+        self.assertEqual((counters['http.status.200'], counters['http.status.503']), (3, server.requests - 3))
+        self.assertGreater(counters['http.bytes_received'], 0)
+        self.assertEqual(counters['db.rows_written'], 15)
+        self.assertEqual(counters['query.rows_read'], 5)
+        self.assertEqual(summary['histograms']['http.request_seconds']['count'], server.requests)
+        self.assertEqual(summary['histograms']['http.backoff_seconds']['count'], server.requests - 3)
+        self.assertEqual(summary['histograms']['query.seconds']['count'], 1)
+        store_seconds = summary['histograms']['stage.store']['sum_ms'] / 1000
+        self.assertAlmostEqual(summary['gauges']['db.rows_per_second'] * store_seconds, 15, delta=1.5)
+
+    def test_latency_excludes_throttling(self):
+        default_metrics.reset()
+        with MockArchiveServer() as server:
+            weather = WeatherData(latitude, longitude, month, day, years[:4])
+            weather.api_url = server.url
+            weather.call_weather_api(session=ArchiveClient(requests_per_second=5))
+
+        histograms = default_metrics.summary()['histograms']
+        self.assertEqual(histograms['http.request_seconds']['count'], 4)
+        self.assertEqual(histograms['http.rate_limit_wait_seconds']['count'], 4)
+        self.assertGreater(histograms['http.rate_limit_wait_seconds']['max_ms'], 150)
+        self.assertLess(histograms['http.request_seconds']['max_ms'], 150)
+
+    def test_profile_sees_threads(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'run.prof')
+            with profile(path), ThreadPoolExecutor(max_workers=2) as executor:
+                list(executor.map(aggregate_values, [[1.0, 2.0, 3.0]] * 4))
+            functions = {function for _, _, function in pstats.Stats(path).stats}
+        self.assertIn('aggregate_values', functions)
+
+
+class TestExport(unittest.TestCase):
+    """
+    test_csv_and_jsonl: exported files hold every row of the region, read in small chunks, with the aggregates of
+    each location and date
+    test_parquet: parquet export, when the optional pyarrow library is installed
+    test_query_table_closes_connection: query_table closes its connection when no rows match
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.path = os.path.join(cls.directory.name, 'weather_data.db')
+        engine = create_weather_engine(cls.path)
+        init_db(engine)
+        session = sessionmaker(bind=engine)()
+        upsert_weather_rows(session, [dict(Latitude=latitude + n, Longitude=longitude, Month=month, Day=day, Year=year,
+                                           temp=float(n), wind_speed=5.0, precipitation=0.5)
+                                      for n in range(3) for year in years])
+        session.commit()
+        session.close()
+        engine.dispose()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def output(self, name: str):
+        return os.path.join(self.directory.name, name)
+
+    def test_csv_and_jsonl(self):
+        region = (latitude - 0.5, latitude + 1.5, longitude - 1, longitude + 1)
+        self.assertEqual(export_query(self.output('out.csv'), region=region, path=self.path, chunk_size=4), 10)
+        self.assertEqual(export_query(self.output('out.jsonl'), region=region, path=self.path, chunk_size=4), 10)
+
+        with open(self.output('out.csv'), newline='') as file:
+            csv_rows = list(csv.DictReader(file))
+        with open(self.output('out.jsonl')) as file:
+            json_rows = [json.loads(line) for line in file]
+
+        self.assertEqual(list(csv_rows[0]), EXPORT_COLUMNS)
+        self.assertEqual([float(row['Latitude']) for row in csv_rows], [row['Latitude'] for row in json_rows])
+        self.assertEqual({row['sum_precipitation'] for row in json_rows}, {2.5})
+        self.assertEqual({row['Latitude']: row['average_temperature'] for row in json_rows},
+                         {latitude: 0.0, latitude + 1: 1.0})
+
+    def test_parquet(self):
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            self.skipTest('pyarrow is not installed')
+        self.assertEqual(export_query(self.output('out.parquet'), path=self.path, chunk_size=4), 15)
+        self.assertEqual(pyarrow.parquet.read_table(self.output('out.parquet')).num_rows, 15)
+
+    def test_query_table_closes_connection(self):
+        connections = []
+
+        def connect(path: str):
+            connections.append(connect_read_only(path))
+            return connections[-1]
+
+        with mock.patch('query.connect_read_only', side_effect=connect), mock.patch('builtins.print') as printed:
+            query_table(0.0, 0.0, month, day, path=self.path)
+        printed.assert_called_once_with('Error')
+        self.assertRaises(sqlite3.ProgrammingError, connections[0].execute, 'SELECT 1;')
+
+
+class TestClimatology(unittest.TestCase):
+    """
+    test_build_and_read: the daily series is gathered in chunks of years, summarised for every calendar day, and read
+    back with one lookup that matches aggregating the same day of each year; building it again sends no requests
+    test_series_ends_in_archive: days after the newest day in the archive, as early in January, are not requested
+    """
+    def test_build_and_read(self):
+        climatology_range = list(range(1995, 2025))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'weather_data.db')
+            engine = create_weather_engine(path)
+            init_db(engine)
+            with MockArchiveServer() as server:
+                client = ArchiveClient(requests_per_second=0)
+                self.assertEqual(build_climatology(engine, latitude, longitude, climatology_range, session=client,
+                                                   api_url=server.url), 366)
+                self.assertEqual(server.requests, 3)
+                self.assertEqual(build_climatology(engine, latitude, longitude, climatology_range, session=client,
+                                                   api_url=server.url), 0)
+                self.assertEqual(server.requests, 3)
+
+                expected = WeatherData(latitude, longitude, month, day, climatology_range)
+                expected.api_url = server.url
+                expected.call_weather_api(batch=True, session=client)
+            engine.dispose()
+
+            stored = read_climatology(latitude + 0.01, longitude, month, day, path)
+            leap_day = read_climatology(latitude, longitude, 2, 29, path)
+
+        temperature = expected.aggregate()['mean_temperature']
+        self.assertEqual((stored['First_Year'], stored['Last_Year'], stored['Years']), (1995, 2024, 30))
+        for statistic in CLIMATOLOGY_STATISTICS:
+            self.assertAlmostEqual(stored[f'temp_{statistic}'], temperature[statistic])
+        self.assertEqual(leap_day['Years'], 8)
+
+    def test_series_ends_in_archive(self):
+        newest = datetime.date(2020, 12, 28)
+        with MockArchiveServer() as server, mock.patch('climatology.newest_archive_date', return_value=newest), \
+                mock.patch('mock_archive.newest_archive_date', return_value=newest):
+            series = fetch_daily_series(latitude, longitude, [2019, 2020, 2021], api_url=server.url)
+        self.assertEqual((len(series), max(series)), (365 + 363, '2020-12-28'))
+
+
+class TestAnalytics(unittest.TestCase):
+    """
+    test_rank_locations: locations are ranked by a statistic of the selected dates and years, with the same result
+    in worker processes as in this process
+    test_rank_requires_coverage: a location missing one of the selected dates is left out unless min_count allows it
+    """
+    def test_rank_locations(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'weather_data.db')
+            engine = create_weather_engine(path)
+            init_db(engine)
+            session = sessionmaker(bind=engine)()
+            upsert_weather_rows(session, [dict(Latitude=latitude + n, Longitude=longitude, Month=month, Day=event_day,
+                                               Year=year, temp=60.0, wind_speed=5.0,
+                                               precipitation=(n * 7 % 5) / 10 + event_day / 100 + (year == 2024))
+                                          for n in range(6) for event_day in (29, 30, 31) for year in years])
+            session.commit()
+            session.close()
+            engine.dispose()
+
+            dates = event_dates(month, 30, 2)
+            in_process = rank_locations('precipitation', 'avg', dates, years[:-1], path=path, top=3, workers=1)
+            in_workers = rank_locations('precipitation', 'avg', dates, years[:-1], path=path, top=3, workers=2,
+                                        chunk_locations=1)
+
+        self.assertEqual(dates, [(10, 30), (10, 31)])
+        self.assertEqual(in_process, in_workers)
+        self.assertEqual([(ranked.rank, ranked.latitude, ranked.count) for ranked in in_process],
+                         [(1, latitude, 8), (2, latitude + 5, 8), (3, latitude + 3, 8)])
+        self.assertAlmostEqual(in_process[0].value, 0.305)
+
+    def test_rank_requires_coverage(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'weather_data.db')
+            engine = create_weather_engine(path)
+            init_db(engine)
+            session = sessionmaker(bind=engine)()
+            # The second location only has October 31, as main.py stores for a single venue date
+            upsert_weather_rows(session, [dict(Latitude=latitude + n, Longitude=longitude, Month=month, Day=event_day,
+                                               Year=year, temp=60.0, wind_speed=5.0, precipitation=n / 10)
+                                          for n in range(2) for event_day in (30, 31) for year in years
+                                          if n == 0 or event_day == 31])
+            session.commit()
+            session.close()
+            engine.dispose()
+
+            dates = event_dates(month, 30, 2)
+            with mock.patch('builtins.print') as printed:
+                covered = rank_locations('precipitation', 'avg', dates, path=path, workers=1)
+            partial = rank_locations('precipitation', 'avg', dates, path=path, workers=1, descending=True,
+                                     min_count=len(years))
+
+        self.assertEqual([(ranked.latitude, ranked.count) for ranked in covered], [(latitude, 10)])
+        self.assertIn('Left out 1 of 2 locations with fewer than 10 values', printed.call_args.args[0])
+        self.assertEqual([(ranked.latitude, ranked.count) for ranked in partial],
+                         [(latitude + 1, 5), (latitude, 10)])
+
+
+class TestReadOnlyStartup(unittest.TestCase):
+    """
+    test_query_path_imports: importing main and query does not load the libraries used to gather and store data
+    """
+    def test_query_path_imports(self):
+        check = ('import sys, main, query; '
+                 'print(",".join(name for name in ("sqlalchemy", "requests") if name in sys.modules))')
+        result = subprocess.run([sys.executable, '-c', check], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(result.stdout.strip(), '')
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,160 @@
+import datetime
+import json
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+# Coordinates are rounded to this many decimal places (about 11 meters) for cache keys
+COORDINATE_DECIMALS = 4
+
+
+class ResponseCache:
+    """
+    Persistent sqlite cache of daily archive values, keyed by rounded latitude and longitude, date, requested
+    variables, unit system, and the source the values came from, so that values from another endpoint, such as a
+    <mock_archive.MockArchiveServer>, are never served for the real archive. Historical values never change, so a
+    cached day is never requested again; days more recent than <min_age_days> are not cached, as the archive may
+    still fill them in.
+
+    Attributes:
+        path: sqlite file holding the cache
+        max_entries: Entries kept before the oldest are evicted; None for no limit
+        max_age: Seconds an entry is kept; None for no limit
+        min_age_days: Days before today a date has to be to be cached
+        hits/misses: Number of dates found and not found by <get_many>
+
+    Methods:
+        get_many(self, lat, long, dates, variables, units, source):
+            returns dictionary of date: values for every cached date
+        put_many(self, lat, long, values, variables, units, source):
+            stores dictionary of date: values
+        evict(self):
+            removes expired entries and the oldest entries over <max_entries>
+        stats(self):
+            returns dictionary with hits, misses, entries
+        clear(self); close(self)
+    """
+
+    def __init__(self, path: str = 'weather_cache.db', max_entries: Optional[int] = None,
+                 max_age: Optional[float] = None, min_age_days: int = 7):
+        """
+        arguments:
+            path: sqlite file to open or create; ':memory:' for a cache that is not saved
+            max_entries, max_age, min_age_days: as described in attributes
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.min_age_days = min_age_days
+        self.hits = 0
+        self.misses = 0
+
+        # One connection shared by every thread using this cache, e.g. the workers of <weather_fetch.fetch_many>
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+
+        # Entries cached before the source was part of the key cannot tell which endpoint they came from
+        columns = {row[1] for row in self._connection.execute('PRAGMA table_info(Response_Cache);')}
+        if columns and 'Source' not in columns:
+            self._connection.execute('DROP TABLE Response_Cache;')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS Response_Cache ('
+            'Latitude REAL NOT NULL, Longitude REAL NOT NULL, Date TEXT NOT NULL, '
+            'Variables TEXT NOT NULL, Units TEXT NOT NULL, Source TEXT NOT NULL, Data TEXT NOT NULL, '
+            'Stored_At REAL NOT NULL, '
+            'PRIMARY KEY (Latitude, Longitude, Date, Variables, Units, Source));')
+        self._connection.execute(
+            'CREATE INDEX IF NOT EXISTS ix_response_cache_stored_at ON Response_Cache (Stored_At);')
+        self._connection.commit()
+
+    def get_many(self, lat: float, long: float, dates: list, variables: str, units: str, source: str):
+        """
+        Looks up cached values for each date, counting hits and misses
+        :param lat: Location Latitude
+        :param long: Location Longitude
+        :param dates: List of dates as 'YYYY-MM-DD'
+        :param variables: Requested daily variables, as sent to the API
+        :param units: Unit system, as sent to the API
+        :param source: Endpoint the values are requested from
+        :return: Dictionary of date: dictionary of values, for dates found in the cache
+        """
+        if not dates:
+            return {}
+        placeholders = ', '.join('?' for _ in dates)
+        query = (f'SELECT Date, Data FROM Response_Cache WHERE Latitude = ? AND Longitude = ? AND Variables = ? '
+                 f'AND Units = ? AND Source = ? AND Stored_At >= ? AND Date IN ({placeholders});')
+        oldest = time.time() - self.max_age if self.max_age else 0
+
+        with self._lock:
+            rows = self._connection.execute(query, (*_round_coordinates(lat, long), variables, units, source, oldest,
+                                                    *dates)).fetchall()
+            found = {date: json.loads(data) for date, data in rows}
+            self.hits += len(found)
+            self.misses += len(set(dates)) - len(found)
+        return found
+
+    def put_many(self, lat: float, long: float, values: dict, variables: str, units: str, source: str):
+        """
+        Stores values for each date that is old enough and has no missing values, then evicts
+        :param lat: Location Latitude
+        :param long: Location Longitude
+        :param values: Dictionary of date ('YYYY-MM-DD'): dictionary of values
+        :param variables: Requested daily variables, as sent to the API
+        :param units: Unit system, as sent to the API
+        :param source: Endpoint the values were requested from
+        """
+        newest = (datetime.date.today() - datetime.timedelta(days=self.min_age_days)).isoformat()
+        now = time.time()
+        rows = [(*_round_coordinates(lat, long), date, variables, units, source, json.dumps(data), now)
+                for date, data in values.items()
+                if date <= newest and None not in data.values()]
+        if not rows:
+            return
+
+        with self._lock:
+            self._connection.executemany('INSERT OR REPLACE INTO Response_Cache VALUES (?, ?, ?, ?, ?, ?, ?, ?);', rows)
+            self._connection.commit()
+        self.evict()
+
+    def evict(self):
+        """
+        Removes entries older than <max_age>, then the oldest entries until at most <max_entries> remain
+        """
+        with self._lock:
+            if self.max_age:
+                self._connection.execute('DELETE FROM Response_Cache WHERE Stored_At < ?;',
+                                         (time.time() - self.max_age,))
+            if self.max_entries is not None:
+                self._connection.execute(
+                    'DELETE FROM Response_Cache WHERE rowid IN (SELECT rowid FROM Response_Cache '
+                    'ORDER BY Stored_At DESC LIMIT -1 OFFSET ?);', (self.max_entries,))
+            self._connection.commit()
+
+    def stats(self):
+        """
+        :return: Dictionary with hits, misses, and number of entries stored
+        """
+        with self._lock:
+            entries = self._connection.execute('SELECT COUNT(*) FROM Response_Cache;').fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries}
+
+    def clear(self):
+        """
+        Removes every entry and resets the hit and miss counters
+        """
+        with self._lock:
+            self._connection.execute('DELETE FROM Response_Cache;')
+            self._connection.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        self._connection.close()
+
+
+def _round_coordinates(lat: float, long: float):
+    """
+    :return: (lat, long) rounded to <COORDINATE_DECIMALS> for use in cache keys
+    """
+    return round(lat, COORDINATE_DECIMALS), round(long, COORDINATE_DECIMALS)
@@ -1,5 +1,30 @@
+import asyncio
+import calendar
+import datetime
+import math
+import time
+from array import array
+
 import requests
 
+from metrics import default_metrics
+from weather_grid import GRID_PARAMETERS, snap_to_grid
+
+ARCHIVE_URL = "https://archive-api.open-meteo.com/v1/archive"
+DAILY_VARIABLES = "precipitation_sum,wind_speed_10m_max,temperature_2m_mean"
+UNITS = "temperature_unit=fahrenheit&wind_speed_unit=mph&precipitation_unit=inch"
+
+# Keys of the weather values in each <weather_info> dictionary
+VARIABLES = ("mean_temperature", "max_wind_speed", "sum_precipitation")
+
+# Percentiles calculated by <aggregate_values>, returned with keys 'p10', 'p25', ...
+PERCENTILES = (10, 25, 50, 75, 90)
+
+# Number of years covered by a single archive request when <call_weather_api> runs in batch mode
+BATCH_CHUNK_YEARS = 10
+
+# Days the archive runs behind today; a request ending after the newest day the archive has fails as a whole
+ARCHIVE_DELAY_DAYS = 5
 
 # url = "https://archive-api.open-meteo.com/v1/archive"
 # params = {
@@ -10,12 +35,111 @@ import requests
 # }
 
 
+class WeatherSeries:
+    """
+    Columnar store of the data gathered for each year: an array of years and one array of doubles per item of
+    <VARIABLES>, with NaN where the API returned None. Each year costs 28 bytes instead of a dictionary with four
+    keys, which matters when many venues over decades are held in memory.
+
+    Held by <WeatherData.weather_series>; <WeatherData.weather_info> is the list of <single_day_data> dictionaries
+    built from it. len, indexing and slicing, iteration, append, extend, item and slice assignment, and == with a list
+    work with dictionaries, which are built when read. It is not a list: json.dumps, sort, insert, and + need
+    <to_list>, and editing a dictionary read from the series does not change it; assign series[index] = dictionary
+    instead.
+
+    Attributes:
+        years: array('i') of years
+        values: Dictionary of each item of <VARIABLES>: array('d') of values, one per year
+        version: Number of changes made, so that memoized results can tell when to recalculate
+
+    Methods:
+        column(self, item):
+            returns array('d') of the values of item, leaving out missing values
+        to_list(self):
+            returns list of <single_day_data> dictionaries
+    """
+
+    __slots__ = ('years', 'values', 'version')
+
+    def __init__(self, records=()):
+        """
+        arguments:
+            records: Iterable of dictionaries with keys year and each item of <VARIABLES>
+        """
+        self.years = array('i')
+        self.values = {item: array('d') for item in VARIABLES}
+        self.version = 0
+        self.extend(records)
+
+    def append(self, record: dict):
+        self.years.append(record['year'])
+        for item in VARIABLES:
+            value = record.get(item)
+            self.values[item].append(math.nan if value is None else value)
+        self.version += 1
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def column(self, item: str):
+        values = self.values[item]
+        return array('d', (value for value in values if value == value))
+
+    def to_list(self):
+        return [self._record(index) for index in range(len(self.years))]
+
+    def _record(self, index: int):
+        record = {"year": self.years[index]}
+        for item in VARIABLES:
+            value = self.values[item][index]
+            record[item] = None if value != value else value
+        return record
+
+    def __len__(self):
+        return len(self.years)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._record(i) for i in range(*index.indices(len(self.years)))]
+        return self._record(range(len(self.years))[index])
+
+    def __setitem__(self, index, record):
+        if isinstance(index, slice):
+            records = self.to_list()
+            records[index] = list(record)
+            self.years = array('i')
+            self.values = {item: array('d') for item in VARIABLES}
+            self.extend(records)
+            self.version += 1
+            return
+        index = range(len(self.years))[index]
+        self.years[index] = record['year']
+        for item in VARIABLES:
+            value = record.get(item)
+            self.values[item][index] = math.nan if value is None else value
+        self.version += 1
+
+    def __iter__(self):
+        return (self._record(index) for index in range(len(self.years)))
+
+    def __eq__(self, other):
+        if isinstance(other, (WeatherSeries, list)):
+            return self.to_list() == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return f'WeatherSeries({self.to_list()!r})'
+
+
 # Create object with location, date, 5-year weather data:
 class WeatherData:
     """
     Attributes:
-        lat: Location Latitude
-        long: Location Longitude
+        api_url: Archive API endpoint; defaults to <ARCHIVE_URL>, can be set per instance, e.g. to a
+        <mock_archive.MockArchiveServer>
+        lat: Latitude of the archive grid cell nearest the location, see <weather_grid.snap_to_grid>
+        long: Longitude of the archive grid cell nearest the location
         mon: Month
         day: Day
         years: List of years to gather from API
@@ -28,12 +152,25 @@ class WeatherData:
         avg_temp/wind: Average Temperature and Wind Speed for location on date
         sum_precip: Sum of Precipitation for location on date
 
-        weather_info: List to contain weather data gathered from API
+        weather_series: <WeatherSeries> to contain weather data gathered from API, one year per item
+        weather_info: List of <single_day_data> dictionaries built from <weather_series> when read; edits to it are
+        copied back into <weather_series>
+        cache: Optional <weather_cache.ResponseCache>; cached years are not requested from the API
+
+        days: Number of days of the event, starting on self.mon/self.day
+        window: Number of days added before and after the event for <call_weather_window>
+        window_info: List to contain window data gathered from API, one dictionary of per-day lists per year
 
     Methods:
-        call_weather_api(self):
+        call_weather_api(self, batch, chunk_years, session):
             Calls weather API to return list of dictionaries containing year, temp, wind_speed, precip for each date
-            returns <weather_info> list
+            batch: request <chunk_years> years per API call instead of one call per year
+            session: object with a requests-style get(url=...) method to send requests through; defaults to requests
+            returns list of dictionaries, a copy of <weather_info>
+
+        plan_requests(self, batch, chunk_years); parse_response(self, years, response, gathered);
+        collect_weather_info(self, gathered); cache_key(self); read_cache(self); write_cache(self, gathered, skip):
+            steps of <call_weather_api>, shared with <AsyncWeatherData.acall_weather_api>
 
         create_weather_list(self, item):
             accepts item: weather param from call_weather_api:
@@ -45,20 +182,42 @@ class WeatherData:
             three parameters for <weather_param>: temp, precipitation, wind_speed
             accepts functions: 'min'; 'max'; 'avg'; 'sum'
             returns aggregate number <function(weather_list[item])>
+
+        columns(self):
+            returns dictionary of 'year' and each weather param: array of values, built once from <weather_series>
+
+        aggregate(self):
+            returns dictionary of weather param: <aggregate_values> statistics, for every weather param at once;
+            memoized until <weather_info> changes
+
+        invalidate(self):
+            clears memoized columns and aggregates; kept for callers that edit data behind <weather_info>
+
+        call_weather_window(self, session):
+            Calls weather API once per year for every day from <window> days before the event to <window> days after
+            returns <window_info> list
+
+        window_aggregate(self, year):
+            returns dictionary of weather param: <aggregate_values> statistics over every day of the windows
     """
 
-    def __init__(self, latitude: float, longitude: float, month: int, day: int, years: list):
+    api_url = ARCHIVE_URL
+
+    def __init__(self, latitude: float, longitude: float, month: int, day: int, years: list, cache=None,
+                 days: int = 1, window: int = 0):
         """
         arguments:
-            (Latitude, Longitude, Month, Day): as numerics
+            (Latitude, Longitude, Month, Day): as numerics; Latitude and Longitude are snapped to the archive grid
             years: as list
+            cache: <weather_cache.ResponseCache> or None
+            days: Length of the event in days
+            window: Days before and after the event to include in <call_weather_window>
                 create attributes for arguments;
                 create list attributes to be gathered from api
                 create attributes to be aggregated from list attributes
                 create list to pass api data into
         """
-        self.lat = latitude
-        self.long = longitude
+        self.lat, self.long = snap_to_grid(latitude, longitude)
         self.mon = month
         self.day = day
         self.years = years
@@ -79,9 +238,96 @@ class WeatherData:
         self.max_precip = None
         self.sum_precip = None
 
-        self.weather_info = []
+        self.weather_series = WeatherSeries()
+        self._weather_list = None
+        self._list_key = None
+        self.cache = cache
 
-    def call_weather_api(self):
+        self.days = days
+        self.window = window
+        self.window_info = []
+
+        self.invalidate()
+
+    @property
+    def weather_info(self):
+        """
+        Data gathered from API as a list of <single_day_data> dictionaries, one per year, built from <weather_series>
+        when first read and updated in place when <weather_series> changes. Edits to the list or its dictionaries, or
+        to a list assigned here, are copied back into <weather_series> before it is next read.
+        """
+        self._sync()
+        if self._weather_list is None:
+            self._weather_list = self.weather_series.to_list()
+            self._list_key = self._series_key()
+        return self._weather_list
+
+    @weather_info.setter
+    def weather_info(self, value: list):
+        if isinstance(value, WeatherSeries):
+            self.weather_series, self._weather_list = value, None
+        else:
+            self.weather_series = WeatherSeries(value)
+            self._weather_list = value if isinstance(value, list) else None
+            self._list_key = self._series_key()
+        self.invalidate()
+
+    def _series_key(self):
+        return id(self.weather_series), self.weather_series.version
+
+    def _sync(self):
+        """
+        Brings <weather_series> and the list of <weather_info> back in step: the list is updated in place if
+        <weather_series> has changed since it was built, otherwise changes made to the list are copied into
+        <weather_series>
+        """
+        if self._weather_list is None:
+            return
+        if self._series_key() != self._list_key:
+            self._weather_list[:] = self.weather_series.to_list()
+        elif self.weather_series != self._weather_list:
+            self.weather_series = WeatherSeries(self._weather_list)
+        self._list_key = self._series_key()
+
+    def invalidate(self):
+        """
+        Clears memoized <columns> and <aggregate>; changes made through <weather_info> or <weather_series>, or by
+        assigning either, are detected without it
+        """
+        self._memo_key = None
+        self._columns = None
+        self._aggregates = None
+
+    def _check_memo(self):
+        """
+        Clears memoized results if <weather_series> or <weather_info> was replaced or has changed since they were
+        calculated
+        """
+        self._sync()
+        key = self._series_key()
+        if key != self._memo_key:
+            self.invalidate()
+            self._memo_key = key
+
+    def archive_url(self, start_date: str, end_date: str):
+        """
+        Builds the <self.api_url> URL for <self.lat>, <self.long> between two dates
+        :param start_date: First date to request, as 'YYYY-MM-DD'
+        :param end_date: Last date to request, as 'YYYY-MM-DD'
+        :return: URL string with daily precipitation_sum, wind_speed_10m_max, temperature_2m_mean, from the cell of
+        the <weather_grid.ARCHIVE_MODEL> grid that <self.lat>, <self.long> are snapped to
+        """
+        return (
+            f"{self.api_url}?"
+            f"latitude={self.lat}&longitude={self.long}&"
+            f"daily={DAILY_VARIABLES}&"
+            f"{GRID_PARAMETERS}&"
+            f"start_date={start_date}&end_date={end_date}&"
+            f"timezone=America%2FChicago&"
+            f"{UNITS}"
+        )
+
+    def call_weather_api(self, batch: bool = False, chunk_years: int = BATCH_CHUNK_YEARS, session=None):
         """
         Method for WeatherData class
         Loops over <self.years> list:
@@ -91,42 +337,233 @@ class WeatherData:
                     with start date and end date being equal to year-self.mon-self.day,
                     timezone: America-Chicago; CDT; GMT-5,
                     units are Fahrenheit, miles-per-hour(mph), inch
-            Add data for day into weather_info list
+            Add data for day into weather_series
 
+        :param batch: If True, request up to <chunk_years> years of daily data per API call and pick out
+        self.mon/self.day for each year locally, instead of one API call per year
+        :param chunk_years: Number of years covered by each API call in batch mode
+        :param session: Object with a get(url=...) method returning a requests-style response, such as
+        <requests.Session> or <weather_fetch.ArchiveClient>; defaults to the <requests> module
         :return: List of dictionaries containing data gathered from API with keys:
-        year; mean_temperature; max_wind_speed; sum_precipitation
+        year; mean_temperature; max_wind_speed; sum_precipitation, a copy of <weather_info>
         """
-        for year in self.years:
-            url = (
-                f"https://archive-api.open-meteo.com/v1/archive?"
-                f"latitude={self.lat}&longitude={self.long}&"
-                f"daily=precipitation_sum,wind_speed_10m_max,temperature_2m_mean&"
-                f"start_date={year}-{self.mon:02d}-{self.day:02d}&end_date={year}-{self.mon:02d}-{self.day:02d}&"
-                f"timezone=America%2FChicago&"
-                f"temperature_unit=fahrenheit&wind_speed_unit=mph&precipitation_unit=inch"
-            )
-            response = requests.get(url=url)
+        http = session or requests
+        cached = self.read_cache()
+        gathered = dict(cached)
 
-            # Attempt to add data from API into weather_info
-            try:
+        for chunk, url in self.plan_requests(batch, chunk_years, skip=cached):
+            response = timed_get(http, url)
+            self.parse_response(chunk, response, gathered)
 
-                data = response.json()
+        self.write_cache(gathered, skip=cached)
+        return self.collect_weather_info(gathered)
 
+    def cache_key(self):
+        """
+        :return: (variables, units, source) of the values requested from <self.api_url> with
+        <weather_grid.GRID_PARAMETERS>, as keyed in <self.cache>
+        """
+        return DAILY_VARIABLES, UNITS, f'{self.api_url}?{GRID_PARAMETERS}'
+
+    def read_cache(self):
+        """
+        Looks up self.mon/self.day for each of <self.years> in <self.cache>
+        :return: Dictionary of year: <single_day_data> for cached years; empty if there is no cache
+        """
+        if self.cache is None:
+            return {}
+        dates = {f'{year}-{self.mon:02d}-{self.day:02d}': year for year in self.years}
+        found = self.cache.get_many(self.lat, self.long, list(dates), *self.cache_key())
+        return {dates[date]: {"year": dates[date], **values} for date, values in found.items()}
+
+    def write_cache(self, gathered: dict, skip: dict):
+        """
+        Stores gathered years that were not already cached into <self.cache>
+        :param gathered: Dictionary of year: <single_day_data>
+        :param skip: Years that came from the cache
+        """
+        if self.cache is None:
+            return
+        values = {f'{year}-{self.mon:02d}-{self.day:02d}': {key: value for key, value in data.items() if key != 'year'}
+                  for year, data in gathered.items() if year not in skip}
+        self.cache.put_many(self.lat, self.long, values, *self.cache_key())
+
+    def plan_requests(self, batch: bool = False, chunk_years: int = BATCH_CHUNK_YEARS, skip=()):
+        """
+        Lists the API calls needed to gather <self.years>
+        Per-year mode requests year-self.mon-self.day on its own for each year.
+        Batch mode splits <self.years> into chunks spanning at most <chunk_years> years and requests every day from
+        the first of self.mon in the first year of each chunk to self.mon/self.day in its last year (the last day of
+        the month if that is not a date, as February 29), so that self.mon/self.day can be picked out for each year
+        locally. A date missing from some years is simply not found, matching the per-year behaviour. Years whose
+        date is after <newest_archive_date> are requested on their own, as in per-year mode, so that they cannot
+        fail the request of the rest of their chunk.
+        :param batch: Request chunks of years instead of single years
+        :param chunk_years: Maximum number of years spanned by one API call in batch mode
+        :param skip: Years that do not need to be requested, such as years found in the cache
+        :return: List of (years, url) tuples, where years is the list of years covered by url
+        """
+        years = [year for year in self.years if year not in skip]
+
+        def single(year: int):
+            date = f'{year}-{self.mon:02d}-{self.day:02d}'
+            return [year], self.archive_url(date, date)
+
+        if not batch:
+            return [single(year) for year in dict.fromkeys(years)]
+
+        newest = newest_archive_date()
+        planned = []
+        for chunk in _chunk_years(years, chunk_years):
+            late = [year for year in chunk if self._last_date(year) > newest]
+            chunk = [year for year in chunk if year not in late]
+            if chunk:
+                planned.append((chunk, self.archive_url(f'{chunk[0]}-{self.mon:02d}-01',
+                                                        self._last_date(chunk[-1]).isoformat())))
+            planned += [single(year) for year in late]
+        return planned
+
+    def _last_date(self, year: int):
+        """
+        :return: datetime.date of self.mon/self.day in year, or of the last day of self.mon if that is not a date
+        """
+        return datetime.date(year, self.mon, min(self.day, calendar.monthrange(year, self.mon)[1]))
+
+    def parse_response(self, years: list, response, gathered: dict):
+        """
+        Picks self.mon/self.day out of an archive API response for each year, shared by every way of sending requests
+        :param years: Years covered by the request, from <plan_requests>
+        :param response: Response with json() and status_code, from requests, a session or an async client
+        :param gathered: Dictionary of year: <single_day_data> to add the data into
+        """
+        # Attempt to add data from API into gathered
+        try:
+            daily = response.json().get('daily')
+            index = {date: i for i, date in enumerate(daily.get('time'))}
+
+            for year in years:
+                date = f'{year}-{self.mon:02d}-{self.day:02d}'
+                if date not in index:
+                    print(f'Failed to retrieve data; {year}: {date} not in archive response')
+                    continue
+                i = index[date]
                 single_day_data = {
                     "year": year,
-                    "mean_temperature": data.get('daily').get('temperature_2m_mean')[0],
-                    "max_wind_speed": data.get('daily').get('wind_speed_10m_max')[0],
-                    "sum_precipitation": data.get('daily').get('precipitation_sum')[0]
+                    "mean_temperature": daily.get('temperature_2m_mean')[i],
+                    "max_wind_speed": daily.get('wind_speed_10m_max')[i],
+                    "sum_precipitation": daily.get('precipitation_sum')[i]
                 }
+                gathered[year] = single_day_data
 
-                self.weather_info.append(single_day_data)
+        except Exception as e:
+            default_metrics.count('parse.errors')
+            label = years[0] if len(years) == 1 else f'{years[0]}-{years[-1]}'
+            print(f'Error: {e}')
+            print(f'Failed to retrieve data; {label}: {response.status_code}')
 
-            except Exception as e:
-                print(f'Error: {e}')
-                print(f'Failed to retrieve data; {year}: {response.status_code}')
+    def collect_weather_info(self, gathered: dict):
+        """
+        Adds gathered data into weather_series in the order of <self.years>
+        :param gathered: Dictionary of year: <single_day_data> from <parse_response>
+        :return: List of dictionaries of every year gathered so far, a copy of <weather_info>
+        """
+        self._sync()
+        for year in self.years:
+            if year in gathered:
+                self.weather_series.append(gathered[year])
 
         print('Data successfully gathered from weather API.')
-        return self.weather_info
+        return self.weather_series.to_list()
+
+    def window_bounds(self, year: int):
+        """
+        :param year: Year of the window
+        :return: (first, last) datetime.date of the window in year, or None if self.mon/self.day is not a date in
+        year (February 29)
+        """
+        try:
+            event = datetime.date(year, self.mon, self.day)
+        except ValueError:
+            return None
+        return (event - datetime.timedelta(days=self.window),
+                event + datetime.timedelta(days=self.days - 1 + self.window))
+
+    def call_weather_window(self, session=None):
+        """
+        Calls archive API once per year for the whole window from <window_bounds>, instead of once per day.
+        Windows found complete in <self.cache> are not requested. The event's first day is also added into
+        <weather_series>, so that the get_<weather_param> methods work as after <call_weather_api>.
+        :param session: Object with a get(url=...) method, as in <call_weather_api>
+        :return: List of dictionaries with keys year; dates; mean_temperature; max_wind_speed; sum_precipitation,
+        where every key but year is a list with one item per day of the window
+        """
+        http = session or requests
+        gathered = {}
+
+        for year in dict.fromkeys(self.years):
+            bounds = self.window_bounds(year)
+            if bounds is None:
+                print(f'Failed to retrieve data; {year}: {self.mon}-{self.day} is not a date in {year}')
+                continue
+            first, last = bounds
+            dates = [(first + datetime.timedelta(days=n)).isoformat() for n in range((last - first).days + 1)]
+
+            cached = {}
+            if self.cache is not None:
+                cached = self.cache.get_many(self.lat, self.long, dates, *self.cache_key())
+            if len(cached) == len(dates):
+                values = [cached[date] for date in dates]
+            else:
+                response = timed_get(http, self.archive_url(dates[0], dates[-1]))
+                values = self._parse_window(year, dates, response)
+                if values is None:
+                    continue
+                if self.cache is not None:
+                    self.cache.put_many(self.lat, self.long, dict(zip(dates, values)), *self.cache_key())
+
+            window_data = {"year": year, "dates": dates}
+            window_data.update({item: [value[item] for value in values] for item in VARIABLES})
+            self.window_info.append(window_data)
+
+            event_date = f'{year}-{self.mon:02d}-{self.day:02d}'
+            gathered[year] = {"year": year, **values[dates.index(event_date)]}
+
+        self.collect_weather_info(gathered)
+        return self.window_info
+
+    def _parse_window(self, year: int, dates: list, response):
+        """
+        Reads every day of a window out of an archive API response
+        :param year: Year of the window, for error messages
+        :param dates: Dates requested, as 'YYYY-MM-DD'
+        :param response: Response with json() and status_code
+        :return: List of dictionaries of weather param: value, one per date, or None if the response is not usable
+        """
+        try:
+            daily = response.json().get('daily')
+            index = {date: i for i, date in enumerate(daily.get('time'))}
+            return [{
+                "mean_temperature": daily.get('temperature_2m_mean')[index[date]],
+                "max_wind_speed": daily.get('wind_speed_10m_max')[index[date]],
+                "sum_precipitation": daily.get('precipitation_sum')[index[date]]
+            } for date in dates]
+
+        except Exception as e:
+            default_metrics.count('parse.errors')
+            print(f'Error: {e}')
+            print(f'Failed to retrieve data; {year}: {response.status_code}')
+            return None
+
+    def window_aggregate(self, year: int = None):
+        """
+        Aggregates every day of the gathered windows with <aggregate_values>, leaving out missing (None) values
+        :param year: Aggregate only the window of this year; every year if None
+        :return: Dictionary of each item of <VARIABLES>: dictionary of statistics
+        """
+        windows = [info for info in self.window_info if year is None or info['year'] == year]
+        return {item: aggregate_values(array('d', (value for info in windows for value in info[item]
+                                                   if value is not None)))
+                for item in VARIABLES}
 
     #   Add methods:
 
@@ -134,72 +571,240 @@ class WeatherData:
         """
         Creates list of numerics to be aggregated in later functions
         :param item: Key from <single_day_data> dictionary from <call_weather_api> function;
-        Items are: 'mean_temperature', 'sum_precipitation', 'max_wind_speed'
+        Items are: 'year', 'mean_temperature', 'sum_precipitation', 'max_wind_speed'
         :return: List of values from dictionary <single_day_data> with key <item>
         """
-        weather_list = []
-        for day in self.weather_info:
-            weather_list.append(day[item])
-        return weather_list
+        self._sync()
+        if item == 'year':
+            return self.weather_series.years.tolist()
+        return [None if value != value else value for value in self.weather_series.values[item]]
+
+    def columns(self):
+        """
+        Copies the arrays of <weather_series> once; years with no value for a weather param (None from the API) are
+        left out of that param's array
+        :return: Dictionary of 'year' and each item of <VARIABLES>: array of values
+        """
+        self._check_memo()
+        if self._columns is None:
+            columns = {'year': array('i', self.weather_series.years)}
+            columns.update({item: self.weather_series.column(item) for item in VARIABLES})
+            self._columns = columns
+        return self._columns
+
+    def aggregate(self):
+        """
+        Aggregates every weather param from <columns> at once with <aggregate_values>; memoized until <weather_info>
+        changes, so repeated calls cost nothing
+        :return: Dictionary of each item of <VARIABLES>: dictionary of statistics
+        """
+        self._check_memo()
+        if self._aggregates is None:
+            self._aggregates = {item: aggregate_values(values) for item, values in self.columns().items()
+                                if item != 'year'}
+        return self._aggregates
 
     #   AVG(temp{Fahrenheit}); MAX(wind_speed{Miles-Per-Hour}); SUM(precipitation{Inches})
 
+    def _get_aggregate(self, item: str, function: str):
+        """
+        Looks up one statistic from <aggregate>
+        :param item: Item of <VARIABLES>
+        :param function: Key of <aggregate_values> result, such as 'min'; 'max'; 'avg'; 'sum'; 'std'; 'p50'
+        :return: Statistic, or None after printing a message if function is not defined
+        """
+        statistics = self.aggregate()[item]
+        if function.lower() in statistics:
+            return statistics[function.lower()]
+        print(f'{function} not defined')
+
     def get_temp(self, function: str):
         """
         Aggregates numeric data from the list <weather_list> using key 'mean_temperature' for dictionary in list
         <weather_info>
-        :param function: Aggregate function: 'min'; 'max'; 'avg'; 'sum'
-        :return: Minimum, Maximum, Average, or Sum of items within <weather_list> from <create_weather_list>
-        """
-        weather = self.create_weather_list(item='mean_temperature')
-
-        if function.lower() == 'min':
-            return min(weather)
-        elif function.lower() == 'max':
-            return max(weather)
-        elif function.lower() == 'avg':
-            return sum(weather) / len(weather)
-        elif function.lower() == 'sum':
-            return sum(weather)
-        else:
-            print(f'{function} not defined')
+        :param function: Aggregate function: 'min'; 'max'; 'avg'; 'sum'; or any other key of <aggregate_values>
+        :return: Minimum, Maximum, Average, or Sum of items within <weather_list>, from <aggregate>
+        """
+        return self._get_aggregate('mean_temperature', function)
 
     def get_precipitation(self, function: str):
         """
         Aggregates numeric data from the list <weather_list> using key 'sum_precipitation' for dictionary in list
         <weather_info>
-        :param function: Aggregate function: 'min'; 'max'; 'avg'; 'sum'
-        :return: Minimum, Maximum, Average, or Sum of items within <weather_list> from <create_weather_list>
-        """
-        weather = self.create_weather_list(item='sum_precipitation')
-
-        if function.lower() == 'min':
-            return min(weather)
-        elif function.lower() == 'max':
-            return max(weather)
-        elif function.lower() == 'avg':
-            return sum(weather) / len(weather)
-        elif function.lower() == 'sum':
-            return sum(weather)
-        else:
-            print(f'{function} not defined')
+        :param function: Aggregate function: 'min'; 'max'; 'avg'; 'sum'; or any other key of <aggregate_values>
+        :return: Minimum, Maximum, Average, or Sum of items within <weather_list>, from <aggregate>
+        """
+        return self._get_aggregate('sum_precipitation', function)
 
     def get_wind_speed(self, function: str):
         """
         Aggregates numeric data from the list <weather_list> using key 'max_wind_speed' for dictionary in list
         <weather_info>
-        :param function: Aggregate function: 'min'; 'max'; 'avg'; 'sum'
-        :return: Minimum, Maximum, Average, or Sum of items within <weather_list> from <create_weather_list>
-        """
-        weather = self.create_weather_list(item='max_wind_speed')
-
-        if function.lower() == 'min':
-            return min(weather)
-        elif function.lower() == 'max':
-            return max(weather)
-        elif function.lower() == 'avg':
-            return sum(weather) / len(weather)
-        elif function.lower() == 'sum':
-            return sum(weather)
+        :param function: Aggregate function: 'min'; 'max'; 'avg'; 'sum'; or any other key of <aggregate_values>
+        :return: Minimum, Maximum, Average, or Sum of items within <weather_list>, from <aggregate>
+        """
+        return self._get_aggregate('max_wind_speed', function)
+
+
+class AsyncWeatherData(WeatherData):
+    """
+    WeatherData for asyncio applications; archive requests are sent as coroutines over one keep-alive
+    <httpx.AsyncClient> and parsed and aggregated exactly as in WeatherData
+
+    Methods:
+        acall_weather_api(self, batch, chunk_years, client, concurrency):
+            async version of <call_weather_api>
+            returns list of dictionaries, a copy of <weather_info>
+    """
+
+    async def acall_weather_api(self, batch: bool = False, chunk_years: int = BATCH_CHUNK_YEARS, client=None,
+                                concurrency: int = 8):
+        """
+        Sends every request from <plan_requests> concurrently, at most <concurrency> at a time
+        :param batch: Passed to <plan_requests>
+        :param chunk_years: Passed to <plan_requests>
+        :param client: <httpx.AsyncClient> to share between lookups; a client is opened and closed if not given
+        :param concurrency: Maximum number of requests in flight for this lookup
+        :return: List of dictionaries containing data gathered from API, as <call_weather_api>
+        """
+        if client is None:
+            import httpx
+
+            async with httpx.AsyncClient(timeout=30.0) as new_client:
+                return await self.acall_weather_api(batch, chunk_years, new_client, concurrency)
+
+        # The cache is sqlite, so it is read and written in a thread instead of blocking the event loop
+        semaphore = asyncio.Semaphore(concurrency)
+        cached = await asyncio.to_thread(self.read_cache)
+        gathered = dict(cached)
+
+        async def fetch(years: list, url: str):
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.get(url=url)
+                record_attempt(response, time.perf_counter() - start)
+            record_response(response)
+            self.parse_response(years, response, gathered)
+
+        await asyncio.gather(*(fetch(years, url) for years, url in self.plan_requests(batch, chunk_years, cached)))
+        await asyncio.to_thread(self.write_cache, gathered, cached)
+        return self.collect_weather_info(gathered)
+
+
+def timed_get(http, url: str):
+    """
+    Sends GET request, recording it in <metrics.default_metrics>. Clients that record each of their attempts
+    themselves, such as <weather_fetch.ArchiveClient>, which waits for its rate limiter and retries, set
+    records_attempts; any other client's call is timed here as a single attempt.
+    :param http: Object with a requests-style get(url=...) method
+    :param url: URL to request
+    :return: Response
+    """
+    if getattr(http, 'records_attempts', False):
+        response = http.get(url=url)
+    else:
+        start = time.perf_counter()
+        response = http.get(url=url)
+        record_attempt(response, time.perf_counter() - start)
+    record_response(response)
+    return response
+
+
+def record_attempt(response, seconds: float):
+    """
+    Records the latency and status code of one attempt at an archive API request in <metrics.default_metrics>
+    :param response: Response from requests, httpx, or a session
+    :param seconds: Time from sending the request to receiving the response
+    """
+    default_metrics.observe('http.request_seconds', seconds)
+    default_metrics.count(f'http.status.{getattr(response, "status_code", "unknown")}')
+
+
+def record_response(response):
+    """
+    Counts an archive API request, with the size of the body of its final response, in <metrics.default_metrics>
+    :param response: Response from requests, httpx, or a session
+    """
+    default_metrics.count('http.requests')
+    content = getattr(response, 'content', None)
+    if isinstance(content, bytes):
+        default_metrics.count('http.bytes_received', len(content))
+
+
+def newest_archive_date(today: datetime.date = None):
+    """
+    :param today: Date to count back from; defaults to today
+    :return: Newest date the archive can be expected to have, <ARCHIVE_DELAY_DAYS> days before today
+    """
+    return (today or datetime.date.today()) - datetime.timedelta(days=ARCHIVE_DELAY_DAYS)
+
+
+def _chunk_years(years: list, chunk_years: int):
+    """
+    Splits years into sorted, de-duplicated chunks where the last year of each chunk is less than <chunk_years>
+    after the first
+    :param years: List of years
+    :param chunk_years: Maximum span of each chunk, in years
+    :return: List of lists of years
+    """
+    chunks = []
+    for year in sorted(set(years)):
+        if chunks and year - chunks[-1][0] < chunk_years:
+            chunks[-1].append(year)
         else:
-            print(f'{function} not defined')
+            chunks.append([year])
+    return chunks
+
+
+def aggregate_values(values):
+    """
+    Calculates count, min, max, sum, avg, and sample standard deviation in one pass (Welford's method), then the
+    <PERCENTILES> from one sorted copy
+    :param values: Sequence of numbers
+    :return: Dictionary with keys count, min, max, sum, avg, std, and p<percentile>; all None except count if values
+    is empty
+    """
+    count = 0
+    total = 0.0
+    mean = 0.0
+    squares = 0.0
+    low = high = None
+
+    for value in values:
+        count += 1
+        total += value
+        delta = value - mean
+        mean += delta / count
+        squares += delta * (value - mean)
+        if low is None or value < low:
+            low = value
+        if high is None or value > high:
+            high = value
+
+    statistics = {
+        'count': count,
+        'min': low,
+        'max': high,
+        'sum': total if count else None,
+        'avg': total / count if count else None,
+        'std': math.sqrt(squares / (count - 1)) if count > 1 else (0.0 if count else None),
+    }
+
+    ordered = sorted(values)
+    for percentile in PERCENTILES:
+        statistics[f'p{percentile}'] = _percentile(ordered, percentile)
+    return statistics
+
+
+def _percentile(ordered: list, percentile: float):
+    """
+    :param ordered: Sorted sequence of numbers
+    :param percentile: Percentile from 0 to 100
+    :return: Percentile of ordered with linear interpolation between closest ranks, or None if ordered is empty
+    """
+    if not ordered:
+        return None
+    rank = (len(ordered) - 1) * percentile / 100
+    lower = math.floor(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
@@ -0,0 +1,232 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import NamedTuple, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import default_metrics
+from weather_data import WeatherData, record_attempt
+from weather_grid import snap_to_grid
+
+# HTTP status codes that are worth retrying: rate limited, or a temporary server-side failure
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class FetchJob(NamedTuple):
+    """
+    One location and date to gather weather data for; plain (latitude, longitude, month, day, years) tuples are
+    accepted wherever a FetchJob is expected
+    """
+    latitude: float
+    longitude: float
+    month: int
+    day: int
+    years: list
+
+
+class FetchResult(NamedTuple):
+    """
+    Result of one FetchJob from <fetch_many>
+        job: The FetchJob
+        weather: WeatherData instance with <weather_info> gathered, or None if the job failed
+        error: Exception raised by the job, or None
+    """
+    job: FetchJob
+    weather: Optional[WeatherData]
+    error: Optional[Exception]
+
+
+class RateLimiter:
+    """
+    Thread-safe limiter spacing calls to <acquire> at least 1 / <requests_per_second> seconds apart across all threads
+
+    Methods:
+        acquire(self):
+            blocks until the caller is allowed to send its next request
+    """
+
+    def __init__(self, requests_per_second: float):
+        """
+        arguments:
+            requests_per_second: Maximum request rate; 0 or None disables the limit
+        """
+        self.interval = 1 / requests_per_second if requests_per_second else 0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Reserves the next free time slot and sleeps until it is reached
+        """
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class ArchiveClient:
+    """
+    Session-like object for <WeatherData.call_weather_api> shared by many threads. Each thread reuses its own pooled
+    keep-alive <requests.Session>; all threads share one RateLimiter; 429 and 5xx responses and connection errors
+    are retried with exponential backoff. Each attempt is timed on its own, from after the rate limiter lets it go,
+    so that time spent waiting for the limiter ('http.rate_limit_wait_seconds') and between retries
+    ('http.backoff_seconds') is recorded apart from network latency ('http.request_seconds').
+
+    Methods:
+        get(self, url, **kwargs):
+            sends GET request to url, retrying up to <max_retries> times
+            returns <requests.Response>
+    """
+
+    # Tells <weather_data.timed_get> that every attempt is recorded here
+    records_attempts = True
+
+    def __init__(self, requests_per_second: float = 5.0, max_retries: int = 4, backoff: float = 0.5,
+                 timeout: float = 30.0, session_factory=requests.Session):
+        """
+        arguments:
+            requests_per_second: Global request rate cap for all threads using this client
+            max_retries: Number of retries after the first attempt
+            backoff: Seconds to wait before the first retry; doubled for each following retry
+            timeout: Seconds to wait for the server on each attempt
+            session_factory: Callable returning a new session for each thread
+        """
+        self.limiter = RateLimiter(requests_per_second)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session_factory = session_factory
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        """
+        :return: Session belonging to the calling thread, created on first use
+        """
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self.session_factory()
+            if isinstance(session, requests.Session):
+                for prefix in ('https://', 'http://'):
+                    session.mount(prefix, HTTPAdapter(pool_connections=1, pool_maxsize=1))
+            self._local.session = session
+        return session
+
+    def get(self, url: str, **kwargs):
+        """
+        Sends GET request through the calling thread's session, waiting for the rate limiter before every attempt
+        :param url: URL to request
+        :return: Last response received; raises the last connection error if no response was received
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        for attempt in range(self.max_retries + 1):
+            with default_metrics.timer('http.rate_limit_wait_seconds'):
+                self.limiter.acquire()
+            response = None
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url=url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                default_metrics.count('http.connection_errors')
+                if attempt == self.max_retries:
+                    raise
+            else:
+                record_attempt(response, time.perf_counter() - start)
+                if response.status_code not in RETRY_STATUS_CODES or attempt == self.max_retries:
+                    return response
+            default_metrics.count('http.retries')
+            delay = self._retry_delay(attempt, response)
+            default_metrics.observe('http.backoff_seconds', delay)
+            time.sleep(delay)
+
+    def _retry_delay(self, attempt: int, response=None):
+        """
+        :param attempt: Number of the attempt that failed, starting at 0
+        :param response: Failed response, if one was received; its Retry-After header is honored
+        :return: Seconds to wait before the next attempt
+        """
+        delay = self.backoff * (2 ** attempt)
+        retry_after = getattr(response, 'headers', None) and response.headers.get('Retry-After')
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        return delay
+
+
+def dedupe_jobs(jobs: list):
+    """
+    Groups jobs whose locations snap to the same archive grid cell and that share their date and years, as they would
+    gather the same data
+    :param jobs: List of FetchJob or (latitude, longitude, month, day, years) tuples
+    :return: Dictionary of FetchJob, with snapped coordinates and a tuple of years: list of the FetchJobs it covers,
+    in the order first seen
+    """
+    groups = {}
+    for item in jobs:
+        job = FetchJob(*item)
+        lat, long = snap_to_grid(job.latitude, job.longitude)
+        groups.setdefault(FetchJob(lat, long, job.month, job.day, tuple(job.years)), []).append(job)
+    return groups
+
+
+def fetch_many(jobs: list, workers: int = 8, requests_per_second: float = 5.0, batch: bool = True,
+               client: Optional[ArchiveClient] = None, cache=None, api_url: Optional[str] = None,
+               max_pending: Optional[int] = None):
+    """
+    Gathers weather data for many locations at the same time, on a pool of <workers> threads sharing one
+    ArchiveClient. Results are yielded as each job finishes, so one slow location does not hold back the rest.
+    Jobs in the same grid cell with the same date and years are gathered once, see <dedupe_jobs>, and their
+    results share one WeatherData.
+    At most <max_pending> jobs are submitted or waiting to be yielded at a time, and a new one is only submitted when
+    a result has been taken, so a slow consumer holds back fetching instead of results piling up in memory.
+    :param jobs: List of FetchJob or (latitude, longitude, month, day, years) tuples
+    :param workers: Number of worker threads
+    :param requests_per_second: Global request rate cap, used when no client is given
+    :param batch: Passed to <WeatherData.call_weather_api>
+    :param client: ArchiveClient to send requests through; created if not given
+    :param cache: <weather_cache.ResponseCache> shared by every job, or None
+    :param api_url: Archive API endpoint to use instead of <WeatherData.api_url>
+    :param max_pending: Most jobs in flight at once; defaults to twice <workers>
+    :return: Generator of FetchResult, one per job, in completion order
+    """
+    client = client or ArchiveClient(requests_per_second=requests_per_second)
+    max_pending = max_pending or 2 * workers
+
+    def run(job: FetchJob):
+        weather = WeatherData(job.latitude, job.longitude, job.month, job.day, list(job.years), cache=cache)
+        if api_url:
+            weather.api_url = api_url
+        weather.call_weather_api(batch=batch, session=client)
+        return weather
+
+    groups = iter(dedupe_jobs(jobs).items())
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+
+        def submit_next():
+            group = next(groups, None)
+            if group is not None:
+                cell_job, shared = group
+                pending[executor.submit(run, cell_job)] = shared
+
+        for _ in range(max_pending):
+            submit_next()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                shared = pending.pop(future)
+                try:
+                    weather, error = future.result(), None
+                except Exception as e:
+                    weather, error = None, e
+                for job in shared:
+                    yield FetchResult(job, weather, error)
+                submit_next()
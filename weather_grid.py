@@ -0,0 +1,49 @@
+# Archive grid helpers shared by weather_data.py, database.py, and query.py, using the standard library only, so that
+# read-only queries can snap coordinates without importing requests or sqlalchemy.
+#
+# Left to its defaults, the archive picks a model itself and, near coasts and lakes, may answer with a nearby land
+# cell of similar elevation instead of the cell the coordinates are in. Requests name <ARCHIVE_MODEL> (ERA5-Land, 0.1
+# degrees, about 11 km) and ask for the nearest cell (<CELL_SELECTION>), so the archive answers with the data of the
+# cell the coordinates are in, and venues a few hundred meters apart get the same cell. Coordinates are snapped to
+# the centre of their cell before requesting, caching, storing, or querying, so each cell is gathered and stored once.
+#
+# The archive also downscales temperature to the elevation of the exact coordinates requested, so snapped values are
+# those at the elevation of the cell centre, not of the venue. In hills or on steep coasts, where the two can be
+# hundreds of meters apart, temperatures can differ by about 0.65 C (1.2 F) per 100 m; wind and precipitation are
+# not downscaled.
+
+# Archive model whose grid coordinates are snapped to, sent as the 'models' parameter of every request
+ARCHIVE_MODEL = 'era5_land'
+
+# Sent as the 'cell_selection' parameter of every request, so that the archive uses the cell the coordinates are in
+CELL_SELECTION = 'nearest'
+
+# Query parameters of every archive request that select the grid snapped to
+GRID_PARAMETERS = f'models={ARCHIVE_MODEL}&cell_selection={CELL_SELECTION}'
+
+# Size of an <ARCHIVE_MODEL> grid cell, in degrees of latitude and longitude
+GRID_RESOLUTION = 0.1
+
+# Decimal places kept in snapped coordinates, so that the same cell always gives exactly the same floats
+GRID_DECIMALS = 4
+
+
+def grid_cell(lat: float, long: float, resolution: float = GRID_RESOLUTION):
+    """
+    :param lat: Location Latitude
+    :param long: Location Longitude
+    :param resolution: Grid cell size in degrees
+    :return: (row, column) integer key of the grid cell nearest the location
+    """
+    return round(lat / resolution), round(long / resolution)
+
+
+def snap_to_grid(lat: float, long: float, resolution: float = GRID_RESOLUTION):
+    """
+    :param lat: Location Latitude
+    :param long: Location Longitude
+    :param resolution: Grid cell size in degrees
+    :return: (lat, long) of the centre of the grid cell nearest the location
+    """
+    row, column = grid_cell(lat, long, resolution)
+    return round(row * resolution, GRID_DECIMALS), round(column * resolution, GRID_DECIMALS)
@@ -0,0 +1,25 @@
+# SQL shared by database.py, which creates the schema through sqlalchemy, and query.py, which reads it with sqlite3
+# only, so that read-only queries do not have to import sqlalchemy
+
+# Aggregate columns calculated from Weather_Table for a location and date, in the order shown by query_table.
+# Used by the Weather_Summary view, over every stored year, and by query_table, over the requested years.
+SUMMARY_COLUMNS = (
+    'AVG(temp) AS average_temperature, MAX(temp) AS max_temperature, MIN(temp) AS min_temperature, '
+    'AVG(wind_speed) AS average_wind_speed, MAX(wind_speed) AS max_wind_speed, '
+    'MIN(wind_speed) AS min_wind_speed, '
+    'SUM(precipitation) AS sum_precipitation, MAX(precipitation) AS max_precipitation, '
+    'MIN(precipitation) AS min_precipitation'
+)
+
+SUMMARY_VIEW = (
+    f'CREATE VIEW IF NOT EXISTS Weather_Summary AS '
+    f'SELECT Latitude, Longitude, Month, Day, MIN(Year) AS First_Year, MAX(Year) AS Last_Year, '
+    f'COUNT(*) AS Years, {SUMMARY_COLUMNS} '
+    f'FROM Weather_Table GROUP BY Latitude, Longitude, Month, Day;'
+)
+
+# Statistics stored in Climatology for each daily value column, named '<column>_<statistic>', in the order shown by
+# query_climatology; the keys come from <weather_data.aggregate_values>
+CLIMATOLOGY_STATISTICS = ('avg', 'min', 'max', 'std', 'p10', 'p25', 'p50', 'p75', 'p90')
+CLIMATOLOGY_VALUES = ('temp', 'wind_speed', 'precipitation')
+CLIMATOLOGY_COLUMNS = [f'{value}_{statistic}' for value in CLIMATOLOGY_VALUES for statistic in CLIMATOLOGY_STATISTICS]